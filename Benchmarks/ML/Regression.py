@@ -0,0 +1,108 @@
+"""
+End-to-end throughput of secure regression training, all three parties run in this process on localhost.
+Example:
+    python -m Benchmarks.ML.Regression --partition vertical --model logistic --batch-sizes 32 128 512 2048
+Reports, for each batch size, samples/second and bytes/sample (sum of the bytes sent by all parties,
+including the triples sent by P2)
+"""
+import argparse
+import time
+
+import numpy as np
+from FastRTAS.Utils import parallel
+from FastRTAS.Core.RTAS import RTAS
+from FastRTAS.ML import VerticalLinearRegression, VerticalLogisticRegression, \
+    HorizontalLinearRegression, HorizontalLogisticRegression
+
+
+def total_sent_bytes(parties: dict):
+    return sum(metrics.sent_wire_bytes for rtas in parties.values() for metrics in rtas.peer.metrics.values())
+
+
+def make_model(rtas: RTAS, args):
+    if args.partition == "vertical":
+        feature_dims = {"P0": args.features // 2, "P1": args.features - args.features // 2}
+        model_class = VerticalLogisticRegression if args.model == "logistic" else VerticalLinearRegression
+        return model_class(rtas, feature_dims, "P1", args.learning_rate)
+    else:
+        model_class = HorizontalLogisticRegression if args.model == "logistic" else HorizontalLinearRegression
+        return model_class(rtas, args.features, ["P0", "P1"], args.learning_rate)
+
+
+def local_batch(party: str, xs: np.ndarray, ys: np.ndarray, args):
+    """
+    The part of a batch held by party
+    """
+    if args.partition == "vertical":
+        if party == "P0":
+            return xs[:, :args.features // 2], None
+        elif party == "P1":
+            return xs[:, args.features // 2:], ys
+    else:
+        # Each data owner holds half of the batch
+        half = xs.shape[0] // 2
+        if party == "P0":
+            return xs[:half], ys[:half]
+        elif party == "P1":
+            return xs[half:], ys[half:]
+    return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--partition", choices=["vertical", "horizontal"], default="vertical")
+    parser.add_argument("--model", choices=["linear", "logistic"], default="logistic")
+    parser.add_argument("--features", type=int, default=32)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 128, 512, 2048])
+    parser.add_argument("--steps", type=int, default=64)
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    parser.add_argument("--cached-triples", type=int, default=16)
+    parser.add_argument("--compression", nargs="*", default=None)
+    parser.add_argument("--base-port", type=int, default=5100)
+    args = parser.parse_args()
+
+    addr_dict = {"127.0.0.1:%d" % (args.base_port + i): "P%d" % i for i in range(3)}
+    configs = {"peer.timeout": 120, "rtas.cached_triples": args.cached_triples,
+               "peer.compression": args.compression}
+    parties = dict()
+
+    def set_up(party: str):
+        rtas = RTAS(addr_dict, party, configs)
+        time.sleep(1)
+        rtas.set_up()
+        parties[party] = rtas
+
+    errs = parallel(set_up, [("P0",), ("P1",), ("P2",)])
+    if errs:
+        raise errs[0]
+
+    rng = np.random.default_rng(0)
+    print("%-10s %-10s %10s %14s %14s" % ("partition", "batch", "steps", "samples/s", "bytes/sample"))
+    for batch_size in args.batch_sizes:
+        xs = rng.normal(0, 1, [batch_size, args.features])
+        ys = (xs @ rng.normal(0, 1, [args.features]) > 0).astype(np.float64)
+        models = {party: make_model(parties[party], args) for party in parties}
+
+        def train(party: str):
+            x_local, y_local = local_batch(party, xs, ys, args)
+            for _ in range(args.steps):
+                models[party].train_batch(x_local, y_local)
+
+        start_bytes = total_sent_bytes(parties)
+        start_time = time.time()
+        errs = parallel(train, [("P0",), ("P1",), ("P2",)])
+        if errs:
+            raise errs[0]
+        elapsed = time.time() - start_time
+        samples = models["P2"].samples
+        print("%-10s %-10d %10d %14.1f %14.1f" % (args.partition, batch_size, args.steps, samples / elapsed,
+                                                  (total_sent_bytes(parties) - start_bytes) / samples))
+
+    for rtas in parties.values():
+        rtas.peer.terminate()
+        if rtas.np_backend is not None:
+            rtas.np_backend.close()
+
+
+if __name__ == "__main__":
+    main()
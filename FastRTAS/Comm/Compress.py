@@ -0,0 +1,188 @@
+import lzma
+import pickle
+import struct
+import zlib
+import numpy as np
+from abc import ABC, abstractmethod
+
+
+class CompressException(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def _pickle_out_of_band(obj: object):
+    """
+    Pickle with protocol 5 so that numpy arrays are kept as separate raw buffers, the buffers are not copied
+    :return: (pickled bytes, list of (memoryview of the raw bytes, itemsize))
+    """
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return data, [(buffer.raw(), memoryview(buffer).itemsize) for buffer in buffers]
+
+
+def chunks_size(chunks: list) -> int:
+    return sum(memoryview(chunk).nbytes for chunk in chunks)
+
+
+def _byte_shuffle(data, itemsize: int):
+    """
+    Group the k-th byte of every item together. For numeric arrays the exponent/high bytes are
+    highly repetitive, so the shuffled bytes deflate much better
+    """
+    if itemsize <= 1 or len(data) % itemsize != 0:
+        return data
+    return np.ascontiguousarray(np.frombuffer(data, np.uint8).reshape(-1, itemsize).T)
+
+
+def _byte_unshuffle(data, itemsize: int) -> bytearray:
+    if itemsize <= 1 or len(data) % itemsize != 0:
+        return data
+    return bytearray(np.frombuffer(data, np.uint8).reshape(itemsize, -1).T.tobytes())
+
+
+_frame_header = ">QI"
+
+
+def _frame_chunks(pickled: tuple, shuffle: bool) -> list:
+    """
+    Layout: [pickle_len, n_buffers, (buffer_len, itemsize) * n_buffers] pickle buffers...
+    :return: The chunks of the frame, they are compressed or sent one by one, so they are never joined
+    """
+    data, raw_buffers = pickled
+    header = struct.pack(_frame_header, len(data), len(raw_buffers))
+    for buffer, itemsize in raw_buffers:
+        header += struct.pack(_frame_header, buffer.nbytes, itemsize)
+    return [header, data] + [_byte_shuffle(buffer, itemsize) if shuffle else buffer for buffer, itemsize in raw_buffers]
+
+
+def _unframe(data: bytes, shuffle: bool) -> object:
+    frame = memoryview(data)
+    pickle_len, n_buffers = struct.unpack_from(_frame_header, frame, 0)
+    offset = struct.calcsize(_frame_header)
+    buffer_infos = []
+    for _ in range(n_buffers):
+        buffer_infos.append(struct.unpack_from(_frame_header, frame, offset))
+        offset += struct.calcsize(_frame_header)
+    pickled = frame[offset: offset + pickle_len]
+    offset += pickle_len
+    buffers = []
+    for buffer_len, itemsize in buffer_infos:
+        buffer = frame[offset: offset + buffer_len]
+        buffers.append(_byte_unshuffle(buffer, itemsize) if shuffle else buffer)
+        offset += buffer_len
+    return pickle.loads(pickled, buffers=buffers)
+
+
+class Codec(ABC):
+    name = None
+
+    @abstractmethod
+    def dumps(self, pickled: tuple) -> list:
+        """
+        :param pickled: The object pickled out of band by _pickle_out_of_band
+        :return: The encoded chunks, the message is their concatenation
+        """
+
+    @abstractmethod
+    def loads(self, data: memoryview) -> object:
+        pass
+
+
+class NoneCodec(Codec):
+    """
+    The uncompressed frame, the buffers of numpy arrays are sent and received without copies
+    """
+    name = "none"
+
+    def dumps(self, pickled: tuple) -> list:
+        return _frame_chunks(pickled, False)
+
+    def loads(self, data: memoryview) -> object:
+        return _unframe(data, False)
+
+
+class ZlibCodec(Codec):
+    """
+    Deflate the out-of-band frame, the decompressed frame is writable, so the arrays are loaded without copies
+    """
+    name = "zlib"
+    shuffle = False
+
+    def __init__(self, level: int=1):
+        self.level = level
+
+    def dumps(self, pickled: tuple) -> list:
+        compressor = zlib.compressobj(self.level)
+        return [compressor.compress(chunk) for chunk in _frame_chunks(pickled, self.shuffle)] + [compressor.flush()]
+
+    def loads(self, data: memoryview) -> object:
+        decompressor = zlib.decompressobj()
+        frame = bytearray(decompressor.decompress(data))
+        frame += decompressor.flush()
+        return _unframe(frame, self.shuffle)
+
+
+class LzmaCodec(Codec):
+    name = "lzma"
+
+    def __init__(self, preset: int=1):
+        self.preset = preset
+
+    def dumps(self, pickled: tuple) -> list:
+        compressor = lzma.LZMACompressor(preset=self.preset)
+        return [compressor.compress(chunk) for chunk in _frame_chunks(pickled, False)] + [compressor.flush()]
+
+    def loads(self, data: memoryview) -> object:
+        return _unframe(bytearray(lzma.decompress(data)), False)
+
+
+class ShuffleZlibCodec(ZlibCodec):
+    """
+    Byte-shuffle every numpy buffer in the object, then deflate
+    """
+    name = "shuffle-zlib"
+    shuffle = True
+
+
+# The position of a codec in this list is its id on the wire, only append new codecs to the end
+codecs = [NoneCodec(), ZlibCodec(), LzmaCodec(), ShuffleZlibCodec()]
+codec_ids = {codec.name: i for i, codec in enumerate(codecs)}
+
+
+def get_codec(name: str) -> Codec:
+    if name not in codec_ids:
+        raise CompressException("Unknown codec %s, available codecs: %s" % (name, list(codec_ids)))
+    return codecs[codec_ids[name]]
+
+
+def encode(obj: object, codec_name: str="none", threshold: int=0):
+    """
+    :param obj:
+    :param codec_name: Codec used if the message is large enough
+    :param threshold: Messages whose raw size is smaller than threshold(in bytes) are not compressed
+    :return: (chunks of the message, raw size, whether the message is compressed).
+             The first chunk is the codec id, the raw size is the size of the uncompressed frame
+    """
+    pickled = _pickle_out_of_band(obj)
+    raw_chunks = codecs[codec_ids["none"]].dumps(pickled)
+    raw_size = chunks_size(raw_chunks)
+    if codec_name != "none" and raw_size >= threshold:
+        compressed_chunks = get_codec(codec_name).dumps(pickled)
+        # Compression does not help, e.g., masked shares are close to random
+        if chunks_size(compressed_chunks) < raw_size:
+            return [bytes([codec_ids[codec_name]])] + compressed_chunks, raw_size, True
+    return [bytes([codec_ids["none"]])] + raw_chunks, raw_size, False
+
+
+def decode(data) -> object:
+    """
+    :param data: A received message, a bytearray keeps the loaded arrays writable
+    """
+    message = memoryview(data)
+    if len(message) == 0 or message[0] >= len(codecs):
+        raise CompressException("Message has unknown codec id")
+    return codecs[message[0]].loads(message[1:])
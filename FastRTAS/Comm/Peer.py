@@ -1,5 +1,7 @@
 import pickle
+import time
 from FastRTAS.Comm.Socket import SocketServer
+from FastRTAS.Comm import Compress
 
 
 class PeerException(Exception):
@@ -19,16 +21,88 @@ class PackedMessage:
         return pickle.dumps(self)
 
 
+class PeerMetrics:
+    """
+    Communication statistics with one peer, raw bytes are the sizes of the uncompressed frames,
+    wire bytes are the sizes actually sent through the socket
+    """
+    def __init__(self):
+        self.sent_messages = 0
+        self.sent_compressed_messages = 0
+        self.sent_raw_bytes = 0
+        self.sent_wire_bytes = 0
+        self.compress_time = 0.0
+        self.recv_messages = 0
+        self.recv_wire_bytes = 0
+        self.decompress_time = 0.0
+
+    def compression_ratio(self):
+        if self.sent_wire_bytes == 0:
+            return 1.0
+        return self.sent_raw_bytes / self.sent_wire_bytes
+
+    def __repr__(self):
+        return "PeerMetrics(sent %d msgs (%d compressed), %d raw bytes, %d wire bytes, %.3fs compressing; " \
+               "received %d msgs, %d wire bytes, %.3fs decompressing)" % \
+               (self.sent_messages, self.sent_compressed_messages, self.sent_raw_bytes, self.sent_wire_bytes,
+                self.compress_time, self.recv_messages, self.recv_wire_bytes, self.decompress_time)
+
+
 class Peer(SocketServer):
-    def __init__(self, address: str, other_addrs: dict, timeout=5):
+    def __init__(self, address: str, other_addrs: dict, timeout=5, compression: list=None, compress_threshold=4096):
+        """
+        :param address:
+        :param other_addrs: dict[address, name]
+        :param timeout:
+        :param compression: Codec names in preference order, e.g. ["shuffle-zlib", "zlib"].
+                The first one supported by the receiving peer is used. None to disable compression
+        :param compress_threshold: Messages smaller than this(in bytes) are sent uncompressed
+        """
+        for codec_name in compression or []:
+            Compress.get_codec(codec_name)
+        self.compression = compression or []
+        self.compress_threshold = compress_threshold
+        self.peer_codecs = dict()
+        self.metrics = {name: PeerMetrics() for name in other_addrs.values()}
         super(Peer, self).__init__(address, other_addrs, timeout)
 
+    def _make_handshake(self) -> bytes:
+        # Tell the peer which codecs we are able to decode
+        return ",".join(Compress.codec_ids).encode("utf-8")
+
+    def _accept_handshake(self, peer_name: str, data: bytes):
+        decodable = str(data, "utf-8").split(",")
+        self.peer_codecs[peer_name] = "none"
+        for codec_name in self.compression:
+            if codec_name in decodable:
+                self.peer_codecs[peer_name] = codec_name
+                break
+
     def send(self, peer_name: str, header: str, obj: object=None):
-        self.send_to(peer_name, PackedMessage(header, obj).serialize())
+        start_time = time.time()
+        # If the peer has not connected to us yet, we do not know its codecs
+        chunks, raw_size, compressed = Compress.encode(
+            PackedMessage(header, obj), self.peer_codecs.get(peer_name, "none"), self.compress_threshold)
+        compress_time = time.time() - start_time
+        self.send_to(peer_name, chunks)
+        metrics = self.metrics[peer_name]
+        metrics.compress_time += compress_time
+        metrics.sent_messages += 1
+        metrics.sent_compressed_messages += compressed
+        metrics.sent_raw_bytes += raw_size
+        metrics.sent_wire_bytes += Compress.chunks_size(chunks)
 
     def recv(self, peer_name: str, header: str):
         data = self.recv_from(peer_name)
-        packed_message = pickle.loads(data)
+        start_time = time.time()
+        try:
+            packed_message = Compress.decode(data)
+        except Exception:
+            raise PeerException("Message corrupted or wrong message")
+        metrics = self.metrics[peer_name]
+        metrics.decompress_time += time.time() - start_time
+        metrics.recv_messages += 1
+        metrics.recv_wire_bytes += len(data)
         if not isinstance(packed_message, PackedMessage):
             raise PeerException("Message corrupted or wrong message")
         if packed_message.header != header:
@@ -11,21 +11,58 @@ class SocketException(Exception):
         return self.msg
 
 
+def _recv_exact(s: socket.socket, n: int) -> bytes:
+    # recv may return fewer bytes than requested for large messages
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        n_bytes = s.recv_into(view[received:], n - received)
+        if n_bytes == 0:
+            raise SocketException("Socket closed")
+        received += n_bytes
+    return buffer
+
+
 def read_socket(s: socket.socket) -> bytes:
     try:
-        len_bytes = s.recv(4)
+        len_bytes = _recv_exact(s, 4)
         content_len = int.from_bytes(len_bytes, byteorder='big')
-        content = s.recv(content_len)
+        content = _recv_exact(s, content_len)
         return content
 
     except:
         raise SocketException("Socket read error")
 
 
-def write_socket(s: socket.socket, content: bytes):
+# Limit of buffers in one sendmsg call (IOV_MAX is at least 1024 on Linux)
+_max_send_buffers = 512
+
+
+def _send_chunks(s: socket.socket, chunks: list):
+    # Gather the chunks with sendmsg instead of joining them, sendmsg may also send only a part of them
+    if not hasattr(s, "sendmsg"):
+        for chunk in chunks:
+            s.sendall(chunk)
+        return
+    chunks = [chunk for chunk in chunks if chunk.nbytes > 0]
+    while len(chunks) > 0:
+        n_bytes = s.sendmsg(chunks[:_max_send_buffers])
+        while len(chunks) > 0 and n_bytes >= chunks[0].nbytes:
+            n_bytes -= chunks.pop(0).nbytes
+        if n_bytes > 0:
+            chunks[0] = chunks[0][n_bytes:]
+
+
+def write_socket(s: socket.socket, content):
+    """
+    :param content: bytes, or a list of bytes-like chunks that are sent as one message without joining them
+    """
     try:
-        len_bytes = len(content).to_bytes(4, 'big')
-        s.send(len_bytes + content)
+        chunks = [memoryview(chunk).cast("B") for chunk in
+                  (content if isinstance(content, list) else [content])]
+        len_bytes = sum(chunk.nbytes for chunk in chunks).to_bytes(4, 'big')
+        _send_chunks(s, [memoryview(len_bytes)] + chunks)
 
     except:
         raise SocketException("Socket send error")
@@ -79,11 +116,32 @@ class SocketServer:
             else:
                 raise SocketException("Get unexpected socket connection from %s" % addr)
 
+            try:
+                self._accept_handshake(self.other_addrs[claimed_addr], read_socket(accpeted_socket))
+            except TimeoutError:
+                raise SocketException("Did not receive handshake after connection from %s" % addr)
+
             not_connected_others.remove(claimed_addr)
             if len(not_connected_others) == 0:
                 break
         self.listening = False
 
+    def _make_handshake(self) -> bytes:
+        """
+        Data sent to every peer right after the address claim, override it to negotiate options at connect time
+        :return:
+        """
+        return b""
+
+    def _accept_handshake(self, peer_name: str, data: bytes):
+        """
+        Called in the listen thread with the handshake data sent by peer_name
+        :param peer_name:
+        :param data:
+        :return:
+        """
+        pass
+
     def connect_all(self):
         def connect_one(peer_addr: str, peer_name: str):
             my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -96,6 +154,7 @@ class SocketServer:
             try:
                 my_socket.connect((peer_ipv4, peer_port))
                 write_socket(my_socket, self.addr.encode("utf-8"))
+                write_socket(my_socket, self._make_handshake())
             except TimeoutError:
                 raise SocketException("Connect to %s: %s failed" % (peer_name, peer_addr))
             self.other_send_sockets[peer_name] = my_socket
@@ -103,7 +162,7 @@ class SocketServer:
         peers = [(peer_addr, self.other_addrs[peer_addr]) for peer_addr in self.other_addrs]
         parallel(connect_one, peers)
 
-    def send_to(self, name: str, data: bytes):
+    def send_to(self, name: str, data):
         if name not in self.other_send_sockets:
             raise SocketException("Peer name %s dose not exist or not connected yet" % name)
         s = self.other_send_sockets[name]
@@ -1,17 +1,146 @@
+import multiprocessing
+import operator
+import pickle
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from typing import Callable
+from FastRTAS.Utils import matmul_shape, inner
+
+
+_elementwise_funcs = [operator.add, operator.sub, operator.mul]
+_matmul_funcs = [np.matmul, operator.matmul]
+
+
+def _pad_shape(shape: tuple, rank: int) -> tuple:
+    return (1,) * (rank - len(shape)) + shape
+
+
+def batch_eval(func: Callable, xs: np.ndarray, ys: np.ndarray, shape_x: tuple, shape_y: tuple) -> np.ndarray:
+    """
+    Evaluate func on n stacked operand pairs, xs has shape (n,) + shape_x and ys has shape (n,) + shape_y.
+    Elementwise ufuncs and matmul are evaluated once by broadcasting over the leading axis,
+    other functions are evaluated pair by pair
+    :return: Stacked results with shape (n,) + shape of func(x, y)
+    """
+    n = xs.shape[0]
+    if len(shape_x) > 0 and len(shape_y) > 0 and \
+            (func in _matmul_funcs or (func is np.dot and len(shape_x) <= 2 and len(shape_y) <= 2)):
+        matrix_x = (1,) + shape_x if len(shape_x) == 1 else shape_x
+        matrix_y = shape_y + (1,) if len(shape_y) == 1 else shape_y
+        rank = max(len(matrix_x), len(matrix_y))
+        ws = np.matmul(xs.reshape((n,) + _pad_shape(matrix_x, rank)), ys.reshape((n,) + _pad_shape(matrix_y, rank)))
+        return ws.reshape((n,) + matmul_shape(shape_x, shape_y))
+    # np.matmul is also a (generalized) ufunc, only plain ufuncs are elementwise
+    # inner reduces the last axis and broadcasts the others, so it batches like an elementwise function
+    if (isinstance(func, np.ufunc) and func.signature is None) or func in _elementwise_funcs or func is inner:
+        rank = max(len(shape_x), len(shape_y))
+        return func(xs.reshape((n,) + _pad_shape(shape_x, rank)), ys.reshape((n,) + _pad_shape(shape_y, rank)))
+    return np.stack([func(xs[i], ys[i]) for i in range(n)])
+
+
+def _product_triples(rng: np.random.Generator, share_std: float, n: int, shape_0: tuple, shape_1: tuple,
+                     func: Callable):
+    # All masks of the n triples are drawn at once, P0's and P1's masks are stacked on the first axis
+    us = rng.normal(0, share_std, (2, n) + shape_0)
+    vs = rng.normal(0, share_std, (2, n) + shape_1)
+    ws = batch_eval(func, us[0] + us[1], vs[0] + vs[1], shape_0, shape_1)
+    w0s = rng.normal(0, share_std ** 2, ws.shape)
+    w1s = np.subtract(ws, w0s, out=ws)
+    return [(us[0, i], vs[0, i], w0s[i]) for i in range(n)], [(us[1, i], vs[1, i], w1s[i]) for i in range(n)]
+
+
+def _private_product_triples(rng: np.random.Generator, share_std: float, n: int, shape_private: tuple,
+                             shape_shared: tuple, func: Callable, private_first: bool):
+    us = rng.normal(0, share_std, (n,) + shape_private)
+    vs = rng.normal(0, share_std, (n,) + shape_shared)
+    if private_first:
+        ws = batch_eval(func, us, vs, shape_private, shape_shared)
+    else:
+        ws = batch_eval(func, vs, us, shape_shared, shape_private)
+    w0s = rng.normal(0, share_std ** 2, ws.shape)
+    w1s = np.subtract(ws, w0s, out=ws)
+    return [(us[i], w0s[i]) for i in range(n)], [(vs[i], w1s[i]) for i in range(n)]
+
+
+def _triples_worker(args):
+    gen_triples, seed, share_std, n, other_args = args
+    return gen_triples(np.random.default_rng(seed), share_std, n, *other_args)
 
 
 class NumpyBackend:
-    def __init__(self, share_std: float=5):
+    def __init__(self, share_std: float=5, seed=None, processes: int=1, parallel_threshold: int=2 ** 24):
+        """
+        :param share_std:
+        :param seed: Seed of the random generator, None for OS entropy
+        :param processes: Number of worker processes for generating large batches of triples
+        :param parallel_threshold: Batches with fewer elements(of all masks) than this are generated in process
+        """
         self.share_std = share_std
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])
+        self.processes = processes
+        self.parallel_threshold = parallel_threshold
+        self.pool = None
+
+    def _generate(self, gen_triples: Callable, n: int, size: int, func: Callable, other_args: tuple):
+        """
+        Generate n triples in this process, or split them over the process pool if the batch is large
+        """
+        n_chunks = min(self.processes, n)
+        if n_chunks <= 1 or n * size < self.parallel_threshold:
+            return gen_triples(self.rng, self.share_std, n, *other_args)
+        try:
+            pickle.dumps(func)
+        except Exception:
+            # Lambdas and closures cannot be sent to the workers
+            return gen_triples(self.rng, self.share_std, n, *other_args)
+
+        if self.pool is None:
+            # Forking a process with running socket threads can deadlock, so workers start from a clean process
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context(start_method))
+        chunk_sizes = [n // n_chunks + (i < n % n_chunks) for i in range(n_chunks)]
+        seeds = self.seed_sequence.spawn(n_chunks)
+        triples_0, triples_1 = [], []
+        for chunk_0, chunk_1 in self.pool.map(
+                _triples_worker, [(gen_triples, seed, self.share_std, chunk_size, other_args)
+                                  for seed, chunk_size in zip(seeds, chunk_sizes)]):
+            triples_0 += chunk_0
+            triples_1 += chunk_1
+        return triples_0, triples_1
+
+    def get_product_triples(self, n: int, shape_0: list, shape_1: list,
+                            func: Callable[[np.ndarray, np.ndarray], np.ndarray]):
+        """
+        :return: Two lists of n triples (u0, v0, w0) and (u1, v1, w1), where w0 + w1 = func(u0 + u1, v0 + v1)
+        """
+        shape_0, shape_1 = tuple(shape_0), tuple(shape_1)
+        size = 2 * (int(np.prod(shape_0)) + int(np.prod(shape_1)))
+        return self._generate(_product_triples, n, size, func, (shape_0, shape_1, func))
 
     def get_product_triple(self, shape_0: list, shape_1: list, func: Callable[[np.ndarray, np.ndarray], np.ndarray]):
-        u0 = np.random.normal(0, self.share_std, shape_0)
-        v0 = np.random.normal(0, self.share_std, shape_1) # std = 5
-        u1 = np.random.normal(0, self.share_std, shape_0)
-        v1 = np.random.normal(0, self.share_std, shape_1)
-        w = func(u0 + u1, v0 + v1)  # std ≈ 10 * 10
-        w0 = np.random.normal(0, self.share_std ** 2, w.shape)
-        w1 = w - w0
-        return (u0, v0, w0), (u1, v1, w1)
\ No newline at end of file
+        triples_0, triples_1 = self.get_product_triples(1, shape_0, shape_1, func)
+        return triples_0[0], triples_1[0]
+
+    def get_private_product_triples(self, n: int, shape_private: list, shape_shared: list,
+                                    func: Callable[[np.ndarray, np.ndarray], np.ndarray], private_first: bool=True):
+        """
+        Triples for the product of a private value and a shared value
+        The owner of the private value gets (u, w0), the other party gets (v, w1), where w0 + w1 = func(u, v)
+        (or func(v, u) if private_first is False)
+        :return: Two lists of n triples for the owner and the other party
+        """
+        shape_private, shape_shared = tuple(shape_private), tuple(shape_shared)
+        size = int(np.prod(shape_private)) + int(np.prod(shape_shared))
+        return self._generate(_private_product_triples, n, size, func,
+                              (shape_private, shape_shared, func, private_first))
+
+    def get_private_product_triple(self, shape_private: list, shape_shared: list,
+                                   func: Callable[[np.ndarray, np.ndarray], np.ndarray], private_first: bool=True):
+        triples_0, triples_1 = self.get_private_product_triples(1, shape_private, shape_shared, func, private_first)
+        return triples_0[0], triples_1[0]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
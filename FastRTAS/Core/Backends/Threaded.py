@@ -0,0 +1,114 @@
+import operator
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+_ufunc_of = {operator.add: np.add, operator.sub: np.subtract, operator.mul: np.multiply}
+
+
+def _elementwise_ufunc(func: Callable):
+    """
+    :return: The ufunc of an elementwise func, None if func is not elementwise
+    """
+    if isinstance(func, np.ufunc) and func.signature is None and func.nin == 2:
+        return func
+    return _ufunc_of.get(func)
+
+
+def _chunks(length: int, n: int) -> list:
+    bounds = np.linspace(0, length, n + 1).astype(int)
+    return [(bounds[i], bounds[i + 1]) for i in range(n) if bounds[i] < bounds[i + 1]]
+
+
+class ThreadedBackend:
+    """
+    Local compute of P0/P1 on a thread pool, NumPy releases the GIL inside ufuncs and random draws.
+
+    Masks are drawn by `streams` child generators spawned from the synced seed, a large mask is split into
+    `streams` contiguous parts and part i is drawn by generator i. So the masks only depend on the seed,
+    streams and min_elements, which P0 and P1 agree on, but not on the number of local threads.
+    """
+    def __init__(self, seed, streams: int, threads: int=None, min_elements: int=2 ** 16):
+        """
+        :param seed: The seed synced between P0 and P1
+        :param streams: Number of child generators
+        :param threads: Number of worker threads, default to streams
+        :param min_elements: Arrays with fewer elements than this are computed in the calling thread
+        """
+        self.streams = streams
+        self.threads = threads or streams
+        self.min_elements = min_elements
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rngs = [np.random.default_rng(s) for s in self.seed_sequence.spawn(streams)]
+        self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix="rtas-compute")
+
+    def normal(self, std: float, shape) -> np.ndarray:
+        """
+        Same as Generator.normal(0, std, shape), but a large array is drawn by all streams in parallel
+        """
+        result = np.empty(shape)
+        flat = result.reshape(-1)
+        if flat.size < self.min_elements:
+            self.rngs[0].standard_normal(out=flat)
+        else:
+            def draw(i, start, end):
+                self.rngs[i].standard_normal(out=flat[start: end])
+            list(self.pool.map(lambda args: draw(*args),
+                               [(i, start, end) for i, (start, end) in enumerate(_chunks(flat.size, self.streams))]))
+        flat *= std
+        return result
+
+    def sum_products(self, func: Callable, pairs: list, addend=None, out: np.ndarray=None):
+        """
+        sum(func(x, y) for x, y in pairs) + addend. If func is elementwise, the output is split into chunks
+        and each thread computes the whole sum of its chunk, otherwise the pairs are evaluated in parallel
+        :param out: Write the result into out if it fits
+        """
+        operands = [operand for pair in pairs for operand in pair]
+        if addend is not None:
+            operands.append(addend)
+        ufunc = _elementwise_ufunc(func)
+        if ufunc is not None and all(isinstance(operand, np.ndarray) for operand in operands):
+            shape = np.broadcast_shapes(*[operand.shape for operand in operands])
+            if len(shape) > 0 and int(np.prod(shape)) >= self.min_elements:
+                return self._chunked_sum(ufunc, pairs, addend, out, shape, operands)
+
+        if len(pairs) > 1 and self.threads > 1:
+            results = list(self.pool.map(lambda pair: func(*pair), pairs))
+        else:
+            results = [func(*pair) for pair in pairs]
+        result = results[0]
+        if len(results) > 1:
+            if out is None or not isinstance(result, np.ndarray) or out.shape != result.shape:
+                out = None
+            result = np.add(result, results[1], out=out)
+        for other in results[2:] + ([] if addend is None else [addend]):
+            result = result + other if not isinstance(result, np.ndarray) else np.add(result, other, out=result)
+        return result
+
+    def _chunked_sum(self, ufunc: np.ufunc, pairs: list, addend, out, shape: tuple, operands: list) -> np.ndarray:
+        dtype = np.result_type(*operands)
+        if out is None or out.shape != shape or out.dtype != dtype or \
+                any(np.may_share_memory(out, operand) for operand in operands):
+            out = np.empty(shape, dtype)
+        # Split the first axis that has enough rows for all threads, or else the longest axis
+        axis = next((i for i, length in enumerate(shape) if length >= self.threads), int(np.argmax(shape)))
+        pairs = [(np.broadcast_to(x, shape), np.broadcast_to(y, shape)) for x, y in pairs]
+        if addend is not None:
+            addend = np.broadcast_to(addend, shape)
+
+        def compute(start, end):
+            index = (slice(None),) * axis + (slice(start, end),)
+            chunk = out[index]
+            ufunc(pairs[0][0][index], pairs[0][1][index], out=chunk)
+            for x, y in pairs[1:]:
+                chunk += ufunc(x[index], y[index])
+            if addend is not None:
+                chunk += addend[index]
+
+        list(self.pool.map(lambda args: compute(*args), _chunks(shape[axis], self.threads)))
+        return out
+
+    def close(self):
+        self.pool.shutdown()
@@ -1 +1,2 @@
-from FastRTAS.Core.Backends.Numpy import NumpyBackend
\ No newline at end of file
+from FastRTAS.Core.Backends.Numpy import NumpyBackend
+from FastRTAS.Core.Backends.Threaded import ThreadedBackend
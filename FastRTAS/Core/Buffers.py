@@ -0,0 +1,36 @@
+import numpy as np
+from collections import OrderedDict
+
+
+class BufferPool:
+    """
+    Scratch arrays keyed by (name, shape, dtype).
+    A buffer returned by get is handed out again by the next get with the same key,
+    so it must not be kept after the operation that requested it
+    """
+    def __init__(self, max_buffers: int=64):
+        self.max_buffers = max_buffers
+        self.buffers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, shape, dtype=np.float64) -> np.ndarray:
+        key = (name, tuple(shape), np.dtype(dtype))
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            self.misses += 1
+            buffer = np.empty(shape, dtype)
+            self.buffers[key] = buffer
+            # Drop the least recently used buffer
+            if len(self.buffers) > self.max_buffers:
+                self.buffers.popitem(last=False)
+        else:
+            self.hits += 1
+            self.buffers.move_to_end(key)
+        return buffer
+
+    def nbytes(self) -> int:
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+    def clear(self):
+        self.buffers.clear()
@@ -0,0 +1,193 @@
+"""
+Coordinated checkpoints of an RTAS session.
+
+Layout of a checkpoint directory:
+    <path>/<checkpoint_id>/<party>/manifest.pkl         metadata, PRNG states, triple cache keys and stats
+    <path>/<checkpoint_id>/<party>/value_<i>.npy(.npz)  the party's part of each RTASValue
+    <path>/<checkpoint_id>/<party>/triples_<i>_<j>.npy  the j-th element of the unused triples of the i-th source
+    <path>/<checkpoint_id>/<party>/COMPLETE             written after everything else
+
+A checkpoint is usable only if every party has completed it, restore picks the latest such checkpoint.
+Arrays are loaded with mmap, so restoring large triple caches is lazy.
+
+Only the synced PRNG of P0/P1 is restored, P2 gets fresh randomness, so new triples and P2's share masks
+never repeat those of the lost run. The unused triples of the checkpoint may already have been used by the
+lost run after the checkpoint. Using a Beaver triple twice on different inputs reveals their difference to
+P0 and P1, so by default restore drops them and P2 generates new ones. restore(reuse_triples=True) keeps them,
+which is only safe if the computation after the checkpoint is replayed with identical inputs.
+"""
+import os
+import pickle
+import shutil
+import time
+import numpy as np
+from FastRTAS.Core.RTAS import RTAS, RTASValue, RTASException
+from FastRTAS.Core.Backends import NumpyBackend, ThreadedBackend
+from FastRTAS.Core.Sparse import is_sparse, sp
+
+
+def _party_dir(path: str, checkpoint_id: int, party: str) -> str:
+    return os.path.join(path, str(checkpoint_id), party)
+
+
+def _complete_ids(path: str, party: str) -> list:
+    if not os.path.isdir(path):
+        return []
+    ids = []
+    for name in os.listdir(path):
+        if name.isdigit() and os.path.exists(os.path.join(_party_dir(path, int(name), party), "COMPLETE")):
+            ids.append(int(name))
+    return sorted(ids)
+
+
+def _save_value(value, file_prefix: str):
+    """
+    :return: The kind of the saved value, used to load it
+    """
+    if value is None:
+        return "none"
+    if is_sparse(value):
+        sp.save_npz(file_prefix + ".npz", value)
+        return "sparse"
+    if isinstance(value, (np.ndarray, np.generic)):
+        np.save(file_prefix + ".npy", value)
+        return "npy"
+    with open(file_prefix + ".pkl", "wb") as f:
+        pickle.dump(value, f)
+    return "pickle"
+
+
+def _load_value(kind: str, file_prefix: str, mmap_mode: str):
+    if kind == "none":
+        return None
+    if kind == "sparse":
+        return sp.load_npz(file_prefix + ".npz")
+    if kind == "npy":
+        value = np.load(file_prefix + ".npy", mmap_mode=mmap_mode)
+        # 0-d arrays are not memory mapped
+        return value if value.ndim > 0 else value[()]
+    with open(file_prefix + ".pkl", "rb") as f:
+        return pickle.load(f)
+
+
+def checkpoint(rtas: RTAS, path: str, checkpoint_id: int, values: dict=None, keep: int=2):
+    """
+    Called by every party at the same point of the computation. Writes this party's shares of values,
+    its PRNG states and its unused triples. Returns after all parties have completed the checkpoint
+    :param rtas:
+    :param path: Local directory of the checkpoints
+    :param checkpoint_id: An increasing id, e.g. the training step
+    :param values: dict[name, RTASValue]
+    :param keep: Number of complete checkpoints to keep
+    :return:
+    """
+    values = values or dict()
+    rtas.barrier("checkpoint %d" % checkpoint_id)
+
+    party_dir = _party_dir(path, checkpoint_id, rtas.party)
+    if os.path.exists(party_dir):
+        shutil.rmtree(party_dir)
+    os.makedirs(party_dir)
+
+    manifest = {"party": rtas.party, "values": dict(), "triple_sources": [], "triple_meta": rtas.triple_meta,
+                "triple_stats": rtas.triple_stats, "synced_prng": rtas.synced_prng, "cpu_backend": None}
+    for i, (name, value) in enumerate(values.items()):
+        kind = _save_value(value.value, os.path.join(party_dir, "value_%d" % i))
+        manifest["values"][name] = (i, kind, value.mode, value.owner_mask, value.shape, value.dtype)
+
+    for i, (triple_source, cache) in enumerate(rtas.triple_sources.items()):
+        if isinstance(cache, list):
+            # P0/P1 keep lists of triples, all triples of a source have the same shapes
+            n_slots = len(cache[0]) if len(cache) > 0 else 0
+            for slot in range(n_slots):
+                np.save(os.path.join(party_dir, "triples_%d_%d.npy" % (i, slot)),
+                        np.stack([triple[slot] for triple in cache]))
+            manifest["triple_sources"].append((triple_source, len(cache), n_slots))
+        else:
+            # P2 only counts the triples held by P0/P1
+            manifest["triple_sources"].append((triple_source, cache, None))
+
+    if rtas.cpu_backend is not None:
+        manifest["cpu_backend"] = (rtas.cpu_backend.rngs, rtas.cpu_backend.min_elements)
+
+    with open(os.path.join(party_dir, "manifest.pkl"), "wb") as f:
+        pickle.dump(manifest, f)
+    open(os.path.join(party_dir, "COMPLETE"), "w").close()
+
+    # After this barrier every party has completed this checkpoint, so older ones can be removed
+    rtas.barrier("checkpoint %d complete" % checkpoint_id)
+    for old_id in _complete_ids(path, rtas.party)[:-keep]:
+        shutil.rmtree(_party_dir(path, old_id, rtas.party))
+        try:
+            # Fails if other parties share this directory and have not removed their parts yet
+            os.rmdir(os.path.join(path, str(old_id)))
+        except OSError:
+            pass
+
+
+def restore(rtas: RTAS, path: str, reuse_triples: bool=False) -> dict:
+    """
+    Resume a session from the latest checkpoint completed by all parties, it replaces RTAS.set_up
+    :param reuse_triples: Keep the unused triples of the checkpoint, only safe if the computation after the
+                          checkpoint is replayed with the same inputs as the lost run. All parties must agree
+    :return: dict[name, RTASValue] of the values passed to checkpoint
+    """
+    gathered = rtas.all_gather("checkpoint ids", (_complete_ids(path, rtas.party), reuse_triples))
+    if len(set(party_reuse for _, party_reuse in gathered.values())) > 1:
+        raise RTASException("restore: parties disagree on reuse_triples")
+    common_ids = set.intersection(*[set(party_ids) for party_ids, _ in gathered.values()])
+    if len(common_ids) == 0:
+        raise RTASException("restore: No checkpoint in %s is completed by all parties" % path)
+    checkpoint_id = max(common_ids)
+    party_dir = _party_dir(path, checkpoint_id, rtas.party)
+
+    with open(os.path.join(party_dir, "manifest.pkl"), "rb") as f:
+        manifest = pickle.load(f)
+    if manifest["party"] != rtas.party:
+        raise RTASException("restore: checkpoint of %s cannot be restored by %s" % (manifest["party"], rtas.party))
+
+    rtas.synced_prng = manifest["synced_prng"]
+    if rtas.party == "P2":
+        # Never restore P2's generator, the lost run may have released triples and masks drawn after the checkpoint
+        if rtas.np_backend is not None:
+            rtas.np_backend.close()
+        rtas.np_backend = NumpyBackend(rtas.share_std, processes=rtas.triple_processes,
+                                       parallel_threshold=rtas.triple_parallel_threshold)
+    if manifest["cpu_backend"] is not None:
+        rngs, min_elements = manifest["cpu_backend"]
+        rtas.cpu_backend = ThreadedBackend(None, len(rngs), rtas.threads, min_elements)
+        rtas.cpu_backend.rngs = rngs
+    rtas.triple_meta = manifest["triple_meta"]
+    rtas.triple_stats = manifest["triple_stats"]
+    for stats in rtas.triple_stats.values():
+        # The configs of this session apply, and the consumption rate is measured again from now on
+        stats.memory_budget = rtas.triple_memory_budget
+        stats.refill_interval = rtas.triple_refill_interval
+        stats.adaptive = rtas.adaptive_triples
+        stats.last_refill_time = time.time()
+
+    rtas.triple_sources = dict()
+    for i, (triple_source, n, n_slots) in enumerate(manifest["triple_sources"]):
+        if not reuse_triples:
+            # Drop the cache on every party, the next product of the source makes P2 generate a new batch
+            rtas.triple_sources[triple_source] = 0 if rtas.party == "P2" else []
+            if triple_source in rtas.triple_stats:
+                # No batch is being consumed, so there is no rate to measure before the next refill
+                rtas.triple_stats[triple_source].cached = 0
+                rtas.triple_stats[triple_source].last_refill_time = None
+        elif n_slots is None:
+            rtas.triple_sources[triple_source] = n
+        else:
+            # Triples are only read, so they stay in the read-only memory maps
+            slots = [np.load(os.path.join(party_dir, "triples_%d_%d.npy" % (i, slot)), mmap_mode="r")
+                     for slot in range(n_slots)]
+            rtas.triple_sources[triple_source] = [tuple(s[j] for s in slots) for j in range(n)]
+
+    values = dict()
+    for name, (i, kind, mode, mask, shape, dtype) in manifest["values"].items():
+        # Copy-on-write, in-place updates do not touch the checkpoint
+        value = _load_value(kind, os.path.join(party_dir, "value_%d" % i), "c")
+        values[name] = RTASValue(mode, value, mask, shape, dtype)
+
+    rtas.barrier("restore %d" % checkpoint_id)
+    return values
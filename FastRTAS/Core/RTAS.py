@@ -1,10 +1,14 @@
 import time
+import operator
 import numpy as np
 from enum import Enum
 from typing import Union, Callable
-from FastRTAS.Core.Backends import NumpyBackend
+from FastRTAS.Core.Backends import NumpyBackend, ThreadedBackend
+from FastRTAS.Core.Buffers import BufferPool
+from FastRTAS.Core.Triples import TripleSourceStats, triple_nbytes
+from FastRTAS.Core.Sparse import is_tensor, is_sparse, as_array, iadd
 from FastRTAS.Comm.Peer import Peer
-from FastRTAS.Utils import parallel
+from FastRTAS.Utils import parallel, matmul_shape, inner, reduced_shape
 
 
 class RTASException(Exception):
@@ -29,12 +33,123 @@ class RTASMode(Enum):
     Shared = _next_rtas_mode_val()
 
 
+# Owner sets are interned as bitmasks, new party names get the next bit
+_party_bits = {"P0": 1, "P1": 2, "P2": 4}
+_owner_names = dict()
+
+
+def owner_mask(owner) -> int:
+    """
+    :param owner: A party name, a list of party names, or a bitmask
+    :return: The bitmask of the owner set
+    """
+    if owner is None:
+        return 0
+    if isinstance(owner, int):
+        return owner
+    if isinstance(owner, str):
+        owner = [owner]
+    mask = 0
+    for party in owner:
+        if party not in _party_bits:
+            _party_bits[party] = 1 << len(_party_bits)
+        mask |= _party_bits[party]
+    return mask
+
+
+def owner_names(mask: int) -> tuple:
+    names = _owner_names.get(mask)
+    if names is None:
+        names = tuple(party for party, bit in _party_bits.items() if mask & bit)
+        _owner_names[mask] = names
+    return names
+
+
+SHARED_OWNER = owner_mask(["P0", "P1"])
+
+
+def _value_meta(value):
+    """
+    :return: (shape, dtype) of a numpy array, scipy sparse matrix or scalar, (None, None) for other objects
+    """
+    if hasattr(value, "shape") and hasattr(value, "dtype"):
+        return value.shape, value.dtype
+    try:
+        return np.shape(value), np.result_type(value)
+    except Exception:
+        return None, None
+
+
 class RTASValue:
-    def __init__(self, mode: RTASMode, value=None, owner=None, shape=None):
-        self.mode = mode
+    """
+    mode, owner, shape and dtype are fixed when the value is created, only value can be updated.
+    shape and dtype are also kept on the parties where value is None
+    """
+    __slots__ = ("_mode", "_owner_mask", "_shape", "_dtype", "value")
+
+    def __init__(self, mode: RTASMode, value=None, owner=None, shape=None, dtype=None):
+        self._mode = mode
         self.value = value
-        self.owner = owner
-        self.shape = shape
+        self._owner_mask = owner_mask(owner)
+        if value is not None:
+            value_shape, value_dtype = _value_meta(value)
+            shape = value_shape if value_shape is not None else shape
+            dtype = value_dtype if value_dtype is not None else dtype
+        if isinstance(shape, int):
+            shape = (shape,)
+        self._shape = None if shape is None else tuple(shape)
+        self._dtype = None if dtype is None else np.dtype(dtype)
+
+    @property
+    def mode(self) -> RTASMode:
+        return self._mode
+
+    @property
+    def owner(self) -> tuple:
+        return owner_names(self._owner_mask)
+
+    @property
+    def owner_mask(self) -> int:
+        return self._owner_mask
+
+    @property
+    def shape(self) -> tuple:
+        return self._shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    def __repr__(self):
+        return "RTASValue(%s, owner=%s, shape=%s, dtype=%s)" % (self._mode.name, self.owner, self._shape, self._dtype)
+
+
+_ufunc_of = {operator.add: np.add, operator.sub: np.subtract, operator.mul: np.multiply,
+             operator.truediv: np.true_divide, operator.matmul: np.matmul}
+
+
+def _output_meta(func: Callable, x: RTASValue, y: RTASValue):
+    """
+    Infer the (shape, dtype) of func(x, y) on parties that do not hold the values, (None, None) for funcs
+    other than binary ufuncs, dot and inner. func is never evaluated, the values may be large or sparse
+    """
+    if x.shape is None or y.shape is None:
+        return None, None
+    dtypes = (x.dtype or np.dtype(np.float64), y.dtype or np.dtype(np.float64))
+    if func is inner:
+        return np.broadcast_shapes(x.shape[:-1], y.shape[:-1]), np.result_type(*dtypes)
+    ufunc = _ufunc_of.get(func, func)
+    if func is np.dot and len(x.shape) <= 2 and len(y.shape) <= 2:
+        ufunc = np.matmul
+    if not isinstance(ufunc, np.ufunc) or ufunc.nin != 2:
+        return None, None
+    # The dtype the holders get, e.g. float64 for true_divide of int64 values
+    dtype = ufunc.resolve_dtypes(dtypes + (None,))[-1]
+    if ufunc is np.matmul:
+        return matmul_shape(x.shape, y.shape), dtype
+    if ufunc.signature is None:
+        return np.broadcast_shapes(x.shape, y.shape), dtype
+    return None, None
 
 
 class RTAS:
@@ -46,8 +161,19 @@ class RTAS:
                 key                     default
                 peer.init_time          1
                 peer.timeout            3
+                peer.compression        None    (codec names in preference order, e.g. ["shuffle-zlib"])
+                peer.compress_threshold 4096
                 rtas.share_std          5
-                rtas.cached_triples     128
+                rtas.cached_triples     128     (size of the first batch of triples of each triple source)
+                rtas.adaptive_triples   True    (adapt the batch size of each triple source, else always cached_triples
+                                                 within the memory budget)
+                rtas.triple_memory_budget   2**28   (max bytes of the cached triples of one source on P0/P1)
+                rtas.triple_refill_interval 1.0     (target seconds between two refills of a triple source)
+                rtas.triple_processes   1       (worker processes of P2 for generating large triples)
+                rtas.triple_parallel_threshold  2**24   (batches with fewer mask elements are generated in P2)
+                rtas.scratch_buffers    64      (max number of cached scratch arrays, 0 to disable)
+                rtas.threads            1       (threads of P0/P1 for local compute and masks, P1 follows P0's setting)
+                rtas.thread_min_elements    2**16   (arrays with fewer elements are computed in one thread)
         """
         addr_dict = addr_dict.copy()
         if {"P0", "P1", "P2"} > set(addr_dict.values()):
@@ -63,7 +189,8 @@ class RTAS:
         if configs is None:
             configs = dict()
 
-        self.peer = Peer(self.addr, addr_dict, configs.get("peer.timeout") or 3)
+        self.peer = Peer(self.addr, addr_dict, configs.get("peer.timeout") or 3,
+                         configs.get("peer.compression"), configs.get("peer.compress_threshold") or 4096)
         time.sleep(configs.get("peer.init_time") or 1)
         self.peer.connect_all()
 
@@ -71,34 +198,81 @@ class RTAS:
 
         # For P0 and P1
         self.synced_prng = None
+        self.cpu_backend = None
+        self.threads = configs.get("rtas.threads") or 1
+        self.thread_min_elements = configs.get("rtas.thread_min_elements") or 2 ** 16
         # For P2
         self.np_backend = None
 
         self.cached_triples = configs.get("rtas.cached_triples") or 128
+        self.triple_processes = configs.get("rtas.triple_processes") or 1
+        self.triple_parallel_threshold = configs.get("rtas.triple_parallel_threshold") or 2 ** 24
+        adaptive_triples = configs.get("rtas.adaptive_triples")
+        self.adaptive_triples = True if adaptive_triples is None else adaptive_triples
+        self.triple_memory_budget = configs.get("rtas.triple_memory_budget") or 2 ** 28
+        self.triple_refill_interval = configs.get("rtas.triple_refill_interval") or 1.0
         self.triple_sources = dict()
+        # For P2, (shape, dtype) of the product of each triple source
+        self.triple_meta = dict()
+        # TripleSourceStats of each triple source, P2 uses them to size the batches
+        self.triple_stats = dict()
+
+        scratch_buffers = configs.get("rtas.scratch_buffers")
+        self.scratch = BufferPool(64 if scratch_buffers is None else scratch_buffers)
 
     def set_up(self):
         """
         In the set-up phase, P0 and P1 will sync their pseudo-random generator
         :return:
         """
-        if self.party == "P0":
-            random_seed = np.random.random_integers(0, 1145141919810)
-            self.synced_prng = np.random.default_rng(random_seed)
-            self.peer.send("P1", "random_seed", random_seed)
-        elif self.party == "P1":
-            random_seed = self.peer.recv("P0", "random_seed")
+        if self.party in ["P0", "P1"]:
+            if self.party == "P0":
+                # The masks depend on the number of streams, so P1 follows P0's setting
+                random_seed, streams, min_elements = \
+                    np.random.random_integers(0, 1145141919810), self.threads, self.thread_min_elements
+                self.peer.send("P1", "random_seed", (random_seed, streams, min_elements))
+            else:
+                random_seed, streams, min_elements = self.peer.recv("P0", "random_seed")
             self.synced_prng = np.random.default_rng(random_seed)
+            if streams > 1:
+                self.cpu_backend = ThreadedBackend(random_seed, streams, self.threads, min_elements)
         else:
-            self.np_backend = NumpyBackend(self.share_std)
+            self.np_backend = NumpyBackend(self.share_std, processes=self.triple_processes,
+                                           parallel_threshold=self.triple_parallel_threshold)
+
+    def all_gather(self, header: str, obj: object=None) -> dict:
+        """
+        Every party sends obj to all other parties
+        :return: dict[party name, obj of that party], including this party
+        """
+        others = [party for party in self.addr_dict.values() if party != self.party]
+        gathered = {self.party: obj}
+
+        def recv(party: str):
+            gathered[party] = self.peer.recv(party, header)
+
+        errs = parallel([self.peer.send] * len(others) + [recv] * len(others),
+                        [(party, header, obj) for party in others] + [(party,) for party in others])
+        if errs:
+            raise RTASException("all_gather: %s failed: %s" % (header, errs))
+        return gathered
+
+    def barrier(self, tag: str=""):
+        """
+        Wait until all parties reach the barrier with the same tag
+        """
+        tags = self.all_gather("barrier", tag)
+        if any(t != tag for t in tags.values()):
+            raise RTASException("barrier: parties are at different barriers %s" % tags)
 
-    def new_private(self, get_value, party="P0", shape=None):
+    def new_private(self, get_value, party="P0", shape=None, dtype=None):
         """
         :param get_value: A function to get the value. Example:
                 lambda: np.random.normal(0, 1, [10])
                 lambda: pd.read_csv("data.csv").values
         :param party: Tht party owns the value
-        :param shape: The shape of the value
+        :param shape: The shape of the value. If it is None, the owner sends the shape and dtype to the other parties
+        :param dtype: The dtype of the value, float64 if shape is specified but dtype is not
         :return:
         """
         if isinstance(party, str):
@@ -108,15 +282,23 @@ class RTAS:
         else:
             raise RTASException("new_private: Party must be party name or list of party names, but get %s" % party)
 
+        non_owners = [p for p in self.addr_dict.values() if p not in party]
         if self.party == party[0]:
             value = get_value()
             for other_party in party[1:]:
                 self.peer.send(other_party, "new_private", value)
+            if shape is None:
+                for other_party in non_owners:
+                    self.peer.send(other_party, "private_meta", _value_meta(value))
         elif self.party in party[1:]:
             value = self.peer.recv(party[0], "new_private")
         else:
             value = None
-        return RTASValue(RTASMode.Private, value, party, shape)
+            if shape is None:
+                shape, dtype = self.peer.recv(party[0], "private_meta")
+            elif dtype is None:
+                dtype = np.float64
+        return RTASValue(RTASMode.Private, value, party, shape, dtype)
 
     def new_public(self, get_value, creator="P0"):
         """
@@ -134,32 +316,29 @@ class RTAS:
         else:
             value = self.peer.recv(creator, "new_public")
 
-        return RTASValue(RTASMode.Public, value, [creator])
+        return RTASValue(RTASMode.Public, value, creator)
 
     def share(self, value: RTASValue):
         if value.mode != RTASMode.Private:
             raise RTASException("share: Can only share a private value")
-        if isinstance(value.owner, list):
-            owner = value.owner[0]
-        else:
-            owner = value.owner
+        if value.shape is None:
+            raise RTASException("share: Cannot share a value whose shape is unknown")
+        owner = value.owner[0]
         if self.party == owner:
-            if not isinstance(value.value, np.ndarray):
-                raise RTASException("share: Can only share a numpy value")
+            if not is_tensor(value.value):
+                raise RTASException("share: Can only share a numpy value or a scipy sparse matrix")
             if self.party in ["P0", "P1"]:
-                if value.shape is None:
-                    raise RTASException("P0/P1 cannot share a value without shape specified(for implicit sharing)")
-                my_share = value.value + self.synced_prng.normal(0, self.share_std, value.shape)
+                my_share = as_array(value.value + self._synced_mask(value.shape))
             else:
                 my_share = None
-                shared_p0 = np.random.normal(0, self.share_std, value.shape)
-                shared_p1 = value.value - shared_p0
+                shared_p0 = self.np_backend.rng.normal(0, self.share_std, value.shape)
+                shared_p1 = as_array(value.value - shared_p0)
                 parallel(self.peer.send,
                          [("P0", "share", shared_p0), ("P1", "share", shared_p1)])
         else:
             if owner in ["P0", "P1"]:
                 if self.party in ["P0", "P1"]:
-                    my_share = - self.synced_prng.normal(0, self.share_std, value.shape)
+                    my_share = - self._synced_mask(value.shape)
                 else:
                     my_share = None
             else:
@@ -168,7 +347,16 @@ class RTAS:
                 else:
                     my_share = None
 
-        return RTASValue(RTASMode.Shared, my_share, ["P0", "P1"])
+        return RTASValue(RTASMode.Shared, my_share, SHARED_OWNER, value.shape,
+                         np.result_type(value.dtype or np.float64, np.float64))
+
+    def _synced_mask(self, shape) -> np.ndarray:
+        """
+        The mask of sharing a value of P0 or P1, P0 and P1 draw the same mask
+        """
+        if self.cpu_backend is not None:
+            return self.cpu_backend.normal(self.share_std, shape)
+        return self.synced_prng.normal(0, self.share_std, shape)
 
     def reveal_to(self, x: RTASValue, party: str="P0"):
         if x.mode == RTASMode.Public:
@@ -183,7 +371,7 @@ class RTAS:
                     another_share = self.peer.recv(other_party, "another_share")
                     return x.value + another_share
                 elif self.party in ["P0", "P1"]:
-                    self.peer.send(other_party, "another_share")
+                    self.peer.send(other_party, "another_share", x.value)
                     return None
                 else:
                     return None
@@ -216,28 +404,70 @@ class RTAS:
         else:
             pass  # This code will never be reached
 
-    def linear(self, x: RTASValue, y: RTASValue, func: Callable[[np.ndarray, np.ndarray], np.ndarray]) -> RTASValue:
+    @staticmethod
+    def _to_out(result: RTASValue, out: RTASValue=None) -> RTASValue:
+        """
+        Write the result into out (if given) and return out
+        """
+        if out is None:
+            return result
+        if out.mode != result.mode:
+            raise RTASException("out should be a %s value, but is %s" % (result.mode, out.mode))
+        if isinstance(out.value, np.ndarray) and isinstance(result.value, np.ndarray):
+            if result.value is not out.value:
+                np.copyto(out.value, result.value)
+        else:
+            out.value = result.value
+        return out
+
+    @staticmethod
+    def _with_meta(result: RTASValue, func: Callable, x: RTASValue, y: RTASValue) -> RTASValue:
+        """
+        Fill in the shape and dtype of a result on the parties that do not hold its value
+        """
+        if result.value is not None or result.shape is not None:
+            return result
+        return RTASValue(result.mode, None, result.owner_mask, *_output_meta(func, x, y))
+
+    def linear(self, x: RTASValue, y: RTASValue, func: Callable[[np.ndarray, np.ndarray], np.ndarray],
+               out: RTASValue=None) -> RTASValue:
+        """
+        :param x:
+        :param y:
+        :param func: A linear function
+        :param out: If given, the result is written into out.value and out is returned.
+                If func is a numpy ufunc, e.g. np.add, it writes into out.value directly without allocation
+        :return:
+        """
+        if out is not None and isinstance(out.value, np.ndarray) and isinstance(func, np.ufunc):
+            ufunc = func
+
+            def func(a, b):
+                return ufunc(a, b, out=out.value)
+        return self._to_out(self._with_meta(self._linear(x, y, func), func, x, y), out)
+
+    def _linear(self, x: RTASValue, y: RTASValue, func: Callable[[np.ndarray, np.ndarray], np.ndarray]) -> RTASValue:
         if x.mode == RTASMode.Public and y.mode == RTASMode.Public:
                 # Initially, a owner of a public value is its creator
                 # So the operation result of two public values' owner should be
                 # the combination of the two public value's owner
                 # Since they both contribute to the result
-                return RTASValue(RTASMode.Public, func(x.value, y.value), list(set(x.owner) | set(y.owner)))
+                return RTASValue(RTASMode.Public, as_array(func(x.value, y.value)), x.owner_mask | y.owner_mask)
         elif x.mode == RTASMode.Public and y.mode == RTASMode.Private:
             if self.party in y.owner:
-                return RTASValue(RTASMode.Private, func(x.value, y.value), y.owner)
+                return RTASValue(RTASMode.Private, as_array(func(x.value, y.value)), y.owner)
             else:
                 return RTASValue(RTASMode.Private, None, y.owner)
         elif x.mode == RTASMode.Private and y.mode == RTASMode.Public:
             if self.party in x.owner:
-                return RTASValue(RTASMode.Private, func(x.value, y.value), x.owner)
+                return RTASValue(RTASMode.Private, as_array(func(x.value, y.value)), x.owner)
             else:
                 return RTASValue(RTASMode.Private, None, x.owner)
         elif x.mode == RTASMode.Private and y.mode == RTASMode.Private:
-            if set(x.owner) != set(y.owner):
+            if x.owner_mask != y.owner_mask:
                 raise RTASException("The owner of private values should be same, but is %s, %s" % (x.owner, y.owner))
             elif self.party in x.owner:
-                return RTASValue(RTASMode.Private, func(x.value, y.value), x.owner)
+                return RTASValue(RTASMode.Private, as_array(func(x.value, y.value)), x.owner)
             else:
                 return RTASValue(RTASMode.Private, None, x.owner)
         elif (x.mode == RTASMode.Shared and y.mode == RTASMode.Private) or \
@@ -245,130 +475,415 @@ class RTAS:
                 raise RTASException("Linear operation of a shared value and a private value is not allowed")
         elif x.mode == RTASMode.Shared and  y.mode == RTASMode.Public:
             if self.party in ["P0", "P1"]:
-                return RTASValue(RTASMode.Shared, func(x.value, y.value / 2), ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, as_array(func(x.value, y.value / 2)), SHARED_OWNER)
             else:
-                return RTASValue(RTASMode.Shared, None, ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, None, SHARED_OWNER)
         elif x.mode == RTASMode.Public and y.mode == RTASMode.Shared:
             if self.party in ["P0", "P1"]:
-                return RTASValue(RTASMode.Shared, func(x.value / 2, y.value), ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, as_array(func(x.value / 2, y.value)), SHARED_OWNER)
             else:
-                return RTASValue(RTASMode.Shared, None, ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, None, SHARED_OWNER)
         elif x.mode == RTASMode.Shared and y.mode == RTASMode.Shared:
             if self.party in ["P0", "P1"]:
-                return RTASValue(RTASMode.Shared, func(x.value, y.value), ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, as_array(func(x.value, y.value)), SHARED_OWNER)
             else:
-                return RTASValue(RTASMode.Shared, None, ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, None, SHARED_OWNER)
         else:
             pass  # This code will never be reached
 
+    def _inplace_add(self, x: RTASValue, y: RTASValue, sign: int) -> RTASValue:
+        if x.mode == RTASMode.Public and y.mode == RTASMode.Public:
+            x.value = iadd(x.value, y.value, sign)
+        elif x.mode == RTASMode.Private and y.mode in [RTASMode.Public, RTASMode.Private]:
+            if y.mode == RTASMode.Private and x.owner_mask != y.owner_mask:
+                raise RTASException("The owner of private values should be same, but is %s, %s" % (x.owner, y.owner))
+            if self.party in x.owner:
+                x.value = iadd(x.value, y.value, sign)
+        elif x.mode == RTASMode.Shared and y.mode == RTASMode.Shared:
+            if self.party in ["P0", "P1"]:
+                x.value = iadd(x.value, y.value, sign)
+        elif x.mode == RTASMode.Shared and y.mode == RTASMode.Public:
+            # Only P0 adds the public value, which avoids the temporary y / 2 of linear
+            if self.party == "P0":
+                x.value = iadd(x.value, y.value, sign)
+        else:
+            raise RTASException("In-place add/sub of a %s value and a %s value is not allowed" % (x.mode, y.mode))
+        return x
+
+    def iadd(self, x: RTASValue, y: RTASValue) -> RTASValue:
+        """
+        x += y, x's arrays are updated in place when possible
+        :return: x
+        """
+        return self._inplace_add(x, y, 1)
+
+    def isub(self, x: RTASValue, y: RTASValue) -> RTASValue:
+        """
+        x -= y, x's arrays are updated in place when possible
+        :return: x
+        """
+        return self._inplace_add(x, y, -1)
+
+    def imul_public(self, x: RTASValue, y: RTASValue) -> RTASValue:
+        """
+        x *= y elementwise, where y is public, x's arrays are updated in place when possible
+        :return: x
+        """
+        if y.mode != RTASMode.Public:
+            raise RTASException("imul_public: Can only multiply a public value, but get %s" % y.mode)
+        if x.mode == RTASMode.Private and self.party not in x.owner:
+            return x
+        elif x.mode == RTASMode.Shared and self.party not in ["P0", "P1"]:
+            return x
+
+        if isinstance(x.value, np.ndarray):
+            np.multiply(x.value, y.value, out=x.value)
+        else:
+            x.value = as_array(x.value.multiply(y.value) if is_sparse(x.value) else x.value * y.value)
+        return x
+
+    def _exchange(self, other: str, header: str, obj):
+        """
+        Send obj to the other party and receive the other party's obj at the same time
+        """
+        received = []
+
+        def recv():
+            received.append(self.peer.recv(other, header))
+
+        errs = parallel([self.peer.send, recv], [(other, header, obj), ()])
+        if errs:
+            raise RTASException("exchange %s with %s failed: %s" % (header, other, errs))
+        return received[0]
+
+    def _scratch_sub(self, name: str, a: np.ndarray, b: np.ndarray, sign: int=1) -> np.ndarray:
+        """
+        a - b (sign=1) or a + b (sign=-1) written into a scratch buffer, the result is only valid until the
+        next call with the same name
+        """
+        if self.scratch.max_buffers == 0:
+            return a - b if sign == 1 else a + b
+        buffer = self.scratch.get(name, np.broadcast_shapes(np.shape(a), np.shape(b)), np.result_type(a, b))
+        if sign == 1:
+            return np.subtract(a, b, out=buffer)
+        else:
+            return np.add(a, b, out=buffer)
+
+    def _fetch_triple(self, triple_source, get_triples: Callable):
+        """
+        Take a triple from the cache of triple_source. If the cache is empty, P2 generates a batch of
+        triples and sends them to P0 and P1, the batch size is decided by self.triple_stats[triple_source].
+        P0 reports its consumption rate before receiving a batch, P2 reads the report after sending the
+        batch and uses it for the next one, so P2 never waits for P0 before generating
+        :param triple_source:
+        :param get_triples: Used by P2, get_triples(n) returns two lists of n triples for P0 and P1
+        :return: The triple for P0/P1, None for P2
+        """
+        # If cache is not initialized
+        if self.party in ["P0", "P1"]:
+            if self.triple_sources.get(triple_source) is None:
+                self.triple_sources[triple_source] = []
+        elif self.party == "P2":
+            if self.triple_sources.get(triple_source) is None:
+                self.triple_sources[triple_source] = 0
+        stats = self.triple_stats.get(triple_source)
+        if stats is None:
+            stats = TripleSourceStats(self.cached_triples, self.triple_memory_budget,
+                                      self.triple_refill_interval, self.adaptive_triples)
+            self.triple_stats[triple_source] = stats
+
+        # If cache is empty
+        if self.party in ["P0", "P1"]:
+            # If triple cache is empty, receive triples from P2
+            if len(self.triple_sources[triple_source]) == 0:
+                rate = stats.measure_rate()
+                if self.party == "P0":
+                    # P0 and P1 consume triples in lockstep, so P0 reports the rate for both
+                    self.peer.send("P2", "triple rate", rate)
+                triples = self.peer.recv("P2", "triples")
+                self.triple_sources[triple_source] += triples
+                stats.on_refill(len(triples), triple_nbytes(triples[0]))
+        elif self.party == "P2":
+            if self.triple_sources[triple_source] == 0:
+                n = stats.next_batch_size()
+                probe = stats.triple_bytes is None
+                # The size of a triple is unknown before the first one is generated
+                triples_P0, triples_P1 = get_triples(1 if probe else n)
+                if probe:
+                    stats.triple_bytes = max(triple_nbytes(triples_P0[0]), triple_nbytes(triples_P1[0]))
+                    n = stats.next_batch_size()
+                    if n > 1:
+                        rest_P0, rest_P1 = get_triples(n - 1)
+                        triples_P0, triples_P1 = triples_P0 + rest_P0, triples_P1 + rest_P1
+                # The last element of a triple is the share of the product
+                self.triple_meta[triple_source] = _value_meta(triples_P0[-1][-1])
+                errs = parallel(self.peer.send, [("P0", "triples", triples_P0), ("P1", "triples", triples_P1)])
+                if errs:
+                    raise RTASException("product: send triples failed %s" % errs)
+                self.triple_sources[triple_source] = n
+                stats.on_refill(n, max(triple_nbytes(triples_P0[0]), triple_nbytes(triples_P1[0])))
+                # P0 sent it before receiving this batch, it sizes the next batch
+                stats.rate = self.peer.recv("P0", "triple rate")
+
+        # Fetch triple from cache
+        stats.on_consume()
+        if self.party in ["P0", "P1"]:
+            return self.triple_sources[triple_source].pop()
+        elif self.party == "P2":
+            self.triple_sources[triple_source] -= 1
+            return None
+
+    def _product_add(self, func: Callable, x, y, w) -> np.ndarray:
+        """
+        func(x, y) + w, on the CPU backend if there is one
+        """
+        if self.cpu_backend is not None:
+            return as_array(self.cpu_backend.sum_products(func, [(x, y)], w))
+        return as_array(func(x, y)) + w
+
+    def _private_shared_product(self, x: RTASValue, y: RTASValue, func: Callable, private_first: bool,
+                                shape_x: list, shape_y: list, triple_source: str):
+        """
+        Product of a private value x and a shared value y. The private value is never shared, so if it is
+        sparse, its owner only evaluates func once on it, and the cost of that evaluation scales with nnz.
+
+        Let the owner be Pi and the other party be Pj, and P2 gives Pi (U, w_i), Pj (V, w_j)
+        where w_i + w_j = f(U, V), then
+            Pi sends X - U, Pj sends y_j - V
+            Pi: f(X, y_i + (y_j - V)) + w_i
+            Pj: f(X - U, V) + w_j
+        and the sum is f(X, y_i + y_j)
+
+        :param private_first: Whether the private value is the first argument of func
+        """
+        def oriented(private_val, shared_val):
+            if private_first:
+                return private_val, shared_val
+            else:
+                return shared_val, private_val
+
+        # P0 and P1 both know the private value, so they can compute product with their shares locally
+        if "P0" in x.owner and "P1" in x.owner:
+            if self.party in ["P0", "P1"]:
+                return RTASValue(RTASMode.Shared, as_array(func(*oriented(x.value, y.value))), SHARED_OWNER)
+            else:
+                return RTASValue(RTASMode.Shared, None, SHARED_OWNER)
+
+        if "P0" in x.owner:
+            holder, other = "P0", "P1"
+        elif "P1" in x.owner:
+            holder, other = "P1", "P0"
+        else:
+            raise RTASException("product: the private value must be owned by P0 or P1 to multiply a shared value, "
+                                "share it first")
+
+        shape_private = x.shape if x.shape is not None else shape_x
+        shape_shared = y.shape if y.shape is not None else shape_y
+        if shape_private is None or shape_shared is None:
+            raise RTASException(
+                "product: shape must be specified, but either RTASValue.shape and shape_x/shape_y is None")
+
+        def get_triples(n: int):
+            holder_triples, other_triples = self.np_backend.get_private_product_triples(
+                n, shape_private, shape_shared, func, private_first)
+            if holder == "P0":
+                return holder_triples, other_triples
+            else:
+                return other_triples, holder_triples
+
+        current_triple = self._fetch_triple(("private", holder, triple_source), get_triples)
+
+        if self.party == holder:
+            u, w = current_triple
+            y_other_sub_v = self._exchange(other, "X-U or Y-V", as_array(x.value - u))
+            return RTASValue(RTASMode.Shared, self._product_add(func, *oriented(x.value, y.value + y_other_sub_v), w),
+                             SHARED_OWNER)
+        elif self.party == other:
+            v, w = current_triple
+            x_sub_u = self._exchange(holder, "X-U or Y-V", self._scratch_sub("Y-V", y.value, v))
+            return RTASValue(RTASMode.Shared, self._product_add(func, *oriented(x_sub_u, v), w), SHARED_OWNER)
+        else:
+            return RTASValue(RTASMode.Shared, None, SHARED_OWNER,
+                             *self.triple_meta[("private", holder, triple_source)])
+
     def product(self, x: RTASValue, y: RTASValue, func: Callable[[np.ndarray, np.ndarray], np.ndarray],
-                shape_x: list=None, shape_y: list=None, triple_source: str=None):
+                shape_x: list=None, shape_y: list=None, triple_source: str=None, out: RTASValue=None):
+        """
+        :param x:
+        :param y:
+        :param func: A bilinear function, e.g. np.matmul. Private and public values can be scipy sparse matrices,
+                in that case func must support them, e.g. operator.matmul rather than np.matmul
+        :param shape_x: Shape of x, only needed if x.shape is unknown
+        :param shape_y: Shape of y, only needed if y.shape is unknown
+        :param triple_source: Products with the same triple_source share the same triple cache,
+                so they must have the same func and shapes
+        :param out: If given, the result is written into out.value and out is returned.
+                For the product of two shared values, the result is accumulated in out.value directly
+        :return:
+        """
+        return self._to_out(
+            self._with_meta(self._product(x, y, func, shape_x, shape_y, triple_source, out), func, x, y), out)
+
+    def _product(self, x: RTASValue, y: RTASValue, func: Callable[[np.ndarray, np.ndarray], np.ndarray],
+                 shape_x: list, shape_y: list, triple_source: str, out: RTASValue) -> RTASValue:
         if x.mode == RTASMode.Public and y.mode == RTASMode.Public:
-            return RTASValue(RTASMode.Public, func(x.value, y.value), list(set(x.owner)|set(y.owner)))
+            return RTASValue(RTASMode.Public, as_array(func(x.value, y.value)), x.owner_mask | y.owner_mask)
         elif x.mode == RTASMode.Private and y.mode == RTASMode.Public:
             if self.party in x.owner:
-                return RTASValue(RTASMode.Private, func(x.value, y.value), x.owner)
+                return RTASValue(RTASMode.Private, as_array(func(x.value, y.value)), x.owner)
             else:
                 return RTASValue(RTASMode.Private, None, x.owner)
         elif x.mode == RTASMode.Public and y.mode == RTASMode.Private:
             if self.party in y.owner:
-                return RTASValue(RTASMode.Private, func(x.value, y.value), y.owner)
+                return RTASValue(RTASMode.Private, as_array(func(x.value, y.value)), y.owner)
             else:
                 return RTASValue(RTASMode.Private, None, y.owner)
         elif x.mode == RTASMode.Private and y.mode == RTASMode.Private:
-            if set(x.owner) != set(y.owner):
+            if x.owner_mask != y.owner_mask:
                 raise RTASException("Cannot get product of two private value with different owner")
             elif self.party in x.owner:
-                return RTASValue(RTASMode.Private, func(x.value, y.value), x.owner)
+                return RTASValue(RTASMode.Private, as_array(func(x.value, y.value)), x.owner)
             else:
                 return RTASValue(RTASMode.Private, None, x.owner)
-        elif (x.mode == RTASMode.Private and y.mode == RTASMode.Shared) or \
-                (x.mode == RTASMode.Shared and y.mode == RTASMode.Private):
-            raise RTASException("Cannot get product of a private value and a shared value")
+        elif x.mode == RTASMode.Private and y.mode == RTASMode.Shared:
+            return self._private_shared_product(x, y, func, True, shape_x, shape_y, triple_source)
+        elif x.mode == RTASMode.Shared and y.mode == RTASMode.Private:
+            return self._private_shared_product(y, x, func, False, shape_y, shape_x, triple_source)
         elif x.mode == RTASMode.Shared and y.mode == RTASMode.Public:
             if self.party in ["P0", "P1"]:
-                return RTASValue(RTASMode.Shared, func(x.value, y.value), ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, as_array(func(x.value, y.value)), SHARED_OWNER)
             else:
-                return RTASValue(RTASMode.Shared, None, ["P0", "p1"])
+                return RTASValue(RTASMode.Shared, None, SHARED_OWNER)
         elif x.mode == RTASMode.Public and y.mode == RTASMode.Shared:
             if self.party in ["P0", "P1"]:
-                return RTASValue(RTASMode.Shared, func(x.value, y.value), ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, as_array(func(x.value, y.value)), SHARED_OWNER)
             else:
-                return RTASValue(RTASMode.Shared, None, ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, None, SHARED_OWNER)
         elif x.mode == RTASMode.Shared and y.mode == RTASMode.Shared:
-            shape_x = x.shape or shape_x
-            shape_y = y.shape or shape_y
-            if shape_x is None and shape_y is None:
+            shape_x = x.shape if x.shape is not None else shape_x
+            shape_y = y.shape if y.shape is not None else shape_y
+            if shape_x is None or shape_y is None:
                 raise RTASException(
                     "product: shape must be specified, but either RTASValue.shape and shape_x/shape_y is None")
 
-            # If cache is not initialized
-            if self.party in ["P0", "P1"]:
-                if self.triple_sources.get(triple_source) is None:
-                    self.triple_sources[triple_source] = []
-            elif self.party == "P2":
-                if self.triple_sources.get(triple_source) is None:
-                    self.triple_sources[triple_source] = 0
-
-            # If cache is empty
-            if self.party in ["P0", "P1"]:
-                # If triple cache is empty, receive triples from P2
-                if len(self.triple_sources[triple_source]) == 0:
-                    triples = self.peer.recv("P2", "triples")
-                    self.triple_sources[triple_source] += triples
-            elif self.party == "P2":
-                if self.triple_sources[triple_source] == 0:
-                    triples_P0 = []
-                    triples_P1 = []
-                    for i in range(self.cached_triples):
-                        triple_0, triple_1 = self.np_backend.get_product_triple(shape_x, shape_y, func)
-                        triples_P0.append(triple_0)
-                        triples_P1.append(triple_1)
-                    errs = parallel(self.peer.send, [("P0", "triples", triples_P0), ("P1", "triples", triples_P1)])
-                    if errs:
-                        raise RTASException("product: send triples failed %s" % errs)
-                    self.triple_sources[triple_source] = self.cached_triples
-
-            # Fetch triple from cache
-            if self.party in ["P0", "P1"]:
-                current_triple = self.triple_sources[triple_source].pop()
-
-            elif self.party == "P2":
-                self.triple_sources[triple_source] -= 1
+            current_triple = self._fetch_triple(
+                triple_source, lambda n: self.np_backend.get_product_triples(n, shape_x, shape_y, func))
 
             # Perform product function
             if self.party in ["P0", "P1"]:
                 u, v, w = current_triple
-                x_sub_u = x.value - u
-                y_sub_v = y.value - v
-                x_sub_u_other = None
-                y_sub_v_other = None
-
-                def send_share(other: str):
-                    self.peer.send(other, "X-U and Y-V", (x_sub_u, y_sub_v))
-
-                def get_other_share(other: str):
-                    global x_sub_u_other, y_sub_v_other
-                    x_sub_u_other, y_sub_v_other = self.peer.recv(other, "X-U and Y-V")
-                if self.party == "P0":
-                    parallel([send_share, get_other_share], [("P1",), ("P1")])
-                else:
-                    parallel([send_share, get_other_share], [("P0",), ("P0")])
+                # The masked values only live during this call, so they are kept in scratch buffers
+                x_sub_u = self._scratch_sub("X-U", x.value, u)
+                y_sub_v = self._scratch_sub("Y-V", y.value, v)
+                other = "P1" if self.party == "P0" else "P0"
+                x_sub_u_other, y_sub_v_other = self._exchange(other, "X-U and Y-V", (x_sub_u, y_sub_v))
 
                 x_sub_u += x_sub_u_other
                 y_sub_v += y_sub_v_other
 
                 if self.party == "P0":
-                    return RTASValue(
-                        RTASMode.Shared,
-                        func(x_sub_u, y_sub_v) + func(u, y_sub_v) + func(x_sub_u, v) + w,
-                        ["P0", "P1"])
+                    # func(X-U, Y-V) + func(u, Y-V) = func(X-U + u, Y-V) since func is bilinear
+                    first_x = self._scratch_sub("X-U+u", x_sub_u, u, -1)
                 else:
-                    return RTASValue(
-                        RTASMode.Shared,
-                        func(u, y_sub_v) + func(x_sub_u, v) + w,
-                        ["P0", "P1"])
+                    first_x = u
+                if self.cpu_backend is not None:
+                    out_value = out.value if out is not None and isinstance(out.value, np.ndarray) else None
+                    result = self.cpu_backend.sum_products(func, [(first_x, y_sub_v), (x_sub_u, v)], w, out_value)
+                    return RTASValue(RTASMode.Shared, as_array(result), SHARED_OWNER)
+                first = func(first_x, y_sub_v)
+                if out is not None and isinstance(out.value, np.ndarray):
+                    out_value = out.value
+                else:
+                    out_value = first if isinstance(first, np.ndarray) else None
+                result = np.add(first, func(x_sub_u, v), out=out_value)
+                result += w
+                return RTASValue(RTASMode.Shared, result, SHARED_OWNER)
             else:
-                return RTASValue(RTASMode.Shared, None, ["P0", "P1"])
+                return RTASValue(RTASMode.Shared, None, SHARED_OWNER, *self.triple_meta[triple_source])
         else:
             pass  # This code will never be reached
+
+    def dot(self, x: RTASValue, y: RTASValue, triple_source=None, out: RTASValue=None) -> RTASValue:
+        """
+        Dot products along the last axis, e.g. a scalar for two vectors, or row-wise dot products for two matrices.
+        For shared values the triple is (u, v, w) with w of the reduced shape, so the parties exchange the masked
+        inputs and only keep a reduced correlation, instead of the elementwise product and a sum
+        :param x:
+        :param y:
+        :param triple_source: Defaults to a cache per pair of shapes
+        :param out:
+        :return:
+        """
+        if triple_source is None:
+            if x.shape is None or y.shape is None:
+                raise RTASException("dot: shapes must be known to use the default triple source, "
+                                    "but are %s, %s" % (x.shape, y.shape))
+            triple_source = ("dot", x.shape, y.shape)
+        return self.product(x, y, inner, triple_source=triple_source, out=out)
+
+    def matvec(self, a: RTASValue, x: RTASValue, triple_source=None, out: RTASValue=None) -> RTASValue:
+        """
+        Matrix-vector product a @ x, the triple is (U, v, w) where w has the shape of the output vector.
+        a can be a scipy sparse matrix if it is private or public
+        :param a:
+        :param x:
+        :param triple_source: Defaults to a cache per pair of shapes
+        :param out:
+        :return:
+        """
+        if triple_source is None:
+            if a.shape is None or x.shape is None:
+                raise RTASException("matvec: shapes must be known to use the default triple source, "
+                                    "but are %s, %s" % (a.shape, x.shape))
+            triple_source = ("matvec", a.shape, x.shape)
+        return self.product(a, x, operator.matmul, triple_source=triple_source, out=out)
+
+    def _local(self, x: RTASValue, func: Callable, shape: tuple, dtype) -> RTASValue:
+        """
+        Apply a linear function of one value locally, no communication is needed even for shared values
+        """
+        if x.mode == RTASMode.Public:
+            holds_value = True
+        elif x.mode == RTASMode.Private:
+            holds_value = self.party in x.owner
+        else:
+            holds_value = self.party in ["P0", "P1"]
+        value = as_array(func(x.value)) if holds_value and x.value is not None else None
+        return RTASValue(x.mode, value, x.owner_mask, shape, dtype)
+
+    def sum(self, x: RTASValue, axis=None, keepdims: bool=False) -> RTASValue:
+        """
+        Sum of a value over axis, computed locally on each share
+        """
+        if x.shape is None:
+            raise RTASException("sum: shape of the value is unknown")
+        try:
+            shape = reduced_shape(x.shape, axis, keepdims)
+        except ValueError as e:
+            raise RTASException("sum: %s" % e)
+
+        def local_sum(value):
+            if is_sparse(value):
+                return np.asarray(value.sum(axis=axis)).reshape(shape)
+            return np.sum(value, axis=axis, keepdims=keepdims)
+
+        return self._local(x, local_sum, shape, x.dtype)
+
+    def mean(self, x: RTASValue, axis=None, keepdims: bool=False) -> RTASValue:
+        """
+        Mean of a value over axis, computed locally on each share
+        """
+        if x.shape is None:
+            raise RTASException("mean: shape of the value is unknown")
+        try:
+            shape = reduced_shape(x.shape, axis, keepdims)
+        except ValueError as e:
+            raise RTASException("mean: %s" % e)
+        count = int(np.prod(x.shape)) // max(int(np.prod(shape)), 1)
+
+        def local_mean(value):
+            if is_sparse(value):
+                return np.asarray(value.sum(axis=axis)).reshape(shape) / count
+            return np.mean(value, axis=axis, keepdims=keepdims)
+
+        return self._local(x, local_mean, shape, np.result_type(x.dtype or np.float64, np.float64))
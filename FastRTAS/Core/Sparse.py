@@ -0,0 +1,53 @@
+import numpy as np
+
+try:
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
+
+
+def is_sparse(x) -> bool:
+    return sp is not None and sp.issparse(x)
+
+
+def is_tensor(x) -> bool:
+    """
+    Values that can be used as RTAS private/public values: numpy arrays or scipy sparse matrices
+    """
+    return isinstance(x, np.ndarray) or is_sparse(x)
+
+
+def as_array(x):
+    """
+    Mixing scipy sparse matrices (not sparse arrays) with dense arrays gives np.matrix,
+    which breaks elementwise semantics later, so convert it back to ndarray
+    Sparse results are kept sparse, their cost scales with nnz
+    """
+    if isinstance(x, np.matrix):
+        return np.asarray(x)
+    return x
+
+
+def to_dense(x) -> np.ndarray:
+    if is_sparse(x):
+        return x.toarray()
+    return np.asarray(x)
+
+
+def iadd(a, b, sign: int=1):
+    """
+    a += b (sign=1) or a -= b (sign=-1), in place if a is an ndarray
+    If b is sparse, only its nonzero entries are touched
+    """
+    if isinstance(a, np.ndarray) and is_sparse(b):
+        b = b.tocoo()
+        np.add.at(a, (b.row, b.col), b.data if sign == 1 else -b.data)
+        return a
+    if isinstance(a, np.ndarray):
+        if sign == 1:
+            np.add(a, b, out=a)
+        else:
+            np.subtract(a, b, out=a)
+        return a
+    # Sparse or scalar a cannot be updated in place
+    return as_array(a + b if sign == 1 else a - b)
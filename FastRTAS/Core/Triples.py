@@ -0,0 +1,78 @@
+import time
+import numpy as np
+
+
+def triple_nbytes(triple: tuple) -> int:
+    return sum(np.asarray(element).nbytes for element in triple)
+
+
+class TripleSourceStats:
+    """
+    Statistics of one triple source. On P2 they also decide the size of the next batch of triples:
+    the batch is scaled so that refills happen about every refill_interval seconds at the consumption
+    rate measured by P0, at most doubling or halving per refill, and the cache of one party never
+    exceeds memory_budget bytes, also when the batch size is not adaptive.
+    P2 cannot measure the rate itself, it only counts the triples and never waits for P0/P1 to use them.
+    P0 reports the rate when it asks for a batch, and P2 reads it after sending the batch, so the report of
+    one refill sizes the next one and the generation never waits for it
+    """
+    def __init__(self, initial_batch: int, memory_budget: int, refill_interval: float, adaptive: bool=True):
+        self.initial_batch = initial_batch
+        self.memory_budget = memory_budget
+        self.refill_interval = refill_interval
+        self.adaptive = adaptive
+
+        self.batch_size = 0
+        self.triple_bytes = None
+        self.refills = 0
+        self.consumed = 0
+        self.cached = 0
+        self.rate = None
+        self.last_refill_time = None
+
+    def max_batch(self) -> int:
+        if self.triple_bytes is None or self.triple_bytes == 0:
+            return self.initial_batch
+        return max(1, self.memory_budget // self.triple_bytes)
+
+    def measure_rate(self):
+        """
+        Used by P0/P1 when the cache is empty, all triples of the last batch were consumed since it was received
+        :return: Triples consumed per second, None before the first batch
+        """
+        if self.last_refill_time is None or self.batch_size == 0:
+            return None
+        self.rate = self.batch_size / max(time.time() - self.last_refill_time, 1e-6)
+        return self.rate
+
+    def next_batch_size(self) -> int:
+        """
+        Used by P2, self.rate is the last rate reported by P0
+        """
+        if not self.adaptive or self.batch_size == 0:
+            n = self.initial_batch
+        elif self.rate is None:
+            n = self.batch_size
+        else:
+            n = int(np.ceil(self.rate * self.refill_interval))
+            n = min(max(n, self.batch_size // 2), self.batch_size * 2)
+        return max(1, min(n, self.max_batch()))
+
+    def on_refill(self, n: int, triple_bytes: int):
+        self.batch_size = n
+        self.triple_bytes = triple_bytes
+        self.refills += 1
+        self.cached += n
+        self.last_refill_time = time.time()
+
+    def on_consume(self):
+        self.consumed += 1
+        self.cached -= 1
+
+    def cache_bytes(self) -> int:
+        return self.cached * (self.triple_bytes or 0)
+
+    def __repr__(self):
+        return "TripleSourceStats(batch %d, %d refills, %d consumed, %d cached, %d bytes/triple, rate %s/s)" % \
+               (self.batch_size, self.refills, self.consumed, self.cached, self.triple_bytes or 0,
+                "%.1f" % self.rate if self.rate is not None else "?")
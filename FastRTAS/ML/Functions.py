@@ -0,0 +1,36 @@
+import numpy as np
+from FastRTAS.Core.RTAS import RTAS, RTASValue, RTASMode
+
+
+def public_constant(value: float, dtype=np.float64) -> RTASValue:
+    """
+    A public constant known by every party in advance (e.g. a hyper-parameter), so it needs no communication
+    """
+    return RTASValue(RTASMode.Public, np.asarray(value, dtype), "P0")
+
+
+def transpose_matmul(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    x^T @ y, e.g. the gradient X^T e of a linear model. It is a module level function so that P2 can send it
+    to its triple generating processes
+    """
+    return x.T @ y
+
+
+# Least squares fit of the sigmoid on [-8, 8]: sigmoid(z) ≈ 0.5 + 0.1501 z - 0.001593 z^3
+sigmoid_coefficients = [0.5, 0.1501097, 0, -0.00159263]
+
+
+def secure_sigmoid(rtas: RTAS, z: RTASValue, triple_source=None) -> RTASValue:
+    """
+    Approximate sigmoid of a shared value with a degree 3 polynomial, which costs 2 products
+    :param rtas:
+    :param z: A shared value
+    :param triple_source: Prefix of the triple sources used by the products
+    :return: A shared value
+    """
+    z2 = rtas.product(z, z, np.multiply, triple_source=(triple_source, "z^2"))
+    z3 = rtas.product(z2, z, np.multiply, triple_source=(triple_source, "z^3"))
+    result = rtas.imul_public(z3, public_constant(sigmoid_coefficients[3]))
+    rtas.iadd(result, rtas.product(z, public_constant(sigmoid_coefficients[1]), np.multiply))
+    return rtas.iadd(result, public_constant(sigmoid_coefficients[0]))
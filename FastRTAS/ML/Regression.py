@@ -0,0 +1,175 @@
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import Iterable
+from FastRTAS.Core.RTAS import RTAS, RTASValue, RTASMode, RTASException, SHARED_OWNER
+from FastRTAS.ML.Functions import public_constant, secure_sigmoid, transpose_matmul
+
+
+class RegressionTrainer(ABC):
+    """
+    Mini-batch gradient descent of a linear/logistic model, the weights are always shared between P0 and P1.
+    Every party runs the same code in lockstep, passing only the data it holds (None for the others).
+    Batches are shared one at a time, so the whole dataset is never held in shared form
+    """
+    logistic = False
+
+    def __init__(self, rtas: RTAS, learning_rate: float=0.1):
+        self.rtas = rtas
+        self.learning_rate = learning_rate
+        self.steps = 0
+        self.samples = 0
+
+    def _zero_weights(self, dim: int) -> RTASValue:
+        value = np.zeros([dim]) if self.rtas.party in ["P0", "P1"] else None
+        return RTASValue(RTASMode.Shared, value, SHARED_OWNER, [dim], np.float64)
+
+    def _activate(self, z: RTASValue, triple_source) -> RTASValue:
+        if self.logistic:
+            return secure_sigmoid(self.rtas, z, triple_source)
+        return z
+
+    def _gradient_step(self, weights: RTASValue, grad: RTASValue, n_samples: int):
+        self.rtas.isub(weights, self.rtas.imul_public(grad, public_constant(self.learning_rate / n_samples)))
+
+    @abstractmethod
+    def train_batch(self, x_local: np.ndarray=None, y_local: np.ndarray=None):
+        """
+        One gradient step on a batch, x_local and y_local are the parts of the batch held by this party
+        """
+
+    def fit(self, batches: Iterable):
+        """
+        :param batches: An iterable of (x_local, y_local), every party must yield the same number of batches
+        :return:
+        """
+        for x_local, y_local in batches:
+            self.train_batch(x_local, y_local)
+
+
+class VerticalRegression(RegressionTrainer):
+    """
+    The features are partitioned by columns, every data party holds some columns of each sample
+    and the label owner holds the labels
+    """
+    def __init__(self, rtas: RTAS, feature_dims: dict, label_owner: str="P0", learning_rate: float=0.1):
+        """
+        :param rtas:
+        :param feature_dims: dict[party, number of columns the party holds], parties must be P0 or P1
+        :param label_owner:
+        :param learning_rate:
+        """
+        super(VerticalRegression, self).__init__(rtas, learning_rate)
+        for party in feature_dims:
+            if party not in ["P0", "P1"]:
+                raise RTASException("VerticalRegression: features must be held by P0 or P1, but get %s" % party)
+        self.feature_dims = feature_dims
+        self.label_owner = label_owner
+        self.weights = {party: self._zero_weights(dim) for party, dim in feature_dims.items()}
+
+    def _forward(self, xs: dict) -> RTASValue:
+        z = None
+        for party, x in xs.items():
+            n = x.shape[0]
+            z_party = self.rtas.product(x, self.weights[party], np.matmul, triple_source=("vertical-z", party, n))
+            z = z_party if z is None else self.rtas.iadd(z, z_party)
+        return self._activate(z, ("vertical-activation", z.shape[0]))
+
+    def _private_features(self, x_local: np.ndarray) -> dict:
+        return {party: self.rtas.new_private(lambda: x_local, party) for party in self.feature_dims}
+
+    def train_batch(self, x_local: np.ndarray=None, y_local: np.ndarray=None):
+        """
+        :param x_local: The columns of the batch held by this party
+        :param y_local: The labels of the batch if this party is the label owner
+        :return:
+        """
+        xs = self._private_features(x_local)
+        error = self._forward(xs)
+        n = error.shape[0]
+        self.rtas.isub(error, self.rtas.share(self.rtas.new_private(lambda: y_local, self.label_owner)))
+        for party, x in xs.items():
+            grad = self.rtas.product(x, error, transpose_matmul, triple_source=("vertical-grad", party, n))
+            self._gradient_step(self.weights[party], grad, n)
+        self.steps += 1
+        self.samples += n
+
+    def predict(self, x_local: np.ndarray=None) -> RTASValue:
+        """
+        :return: The shared prediction
+        """
+        return self._forward(self._private_features(x_local))
+
+    def reveal_weights(self, party: str="P0") -> dict:
+        return {p: self.rtas.reveal_to(w, party) for p, w in self.weights.items()}
+
+
+class HorizontalRegression(RegressionTrainer):
+    """
+    The samples are partitioned by rows, every data party holds all columns and the labels of its own samples
+    """
+    def __init__(self, rtas: RTAS, n_features: int, data_owners: list=None, learning_rate: float=0.1):
+        """
+        :param rtas:
+        :param n_features:
+        :param data_owners: Parties holding samples, must be P0 or P1
+        :param learning_rate:
+        """
+        super(HorizontalRegression, self).__init__(rtas, learning_rate)
+        data_owners = data_owners or ["P0", "P1"]
+        for party in data_owners:
+            if party not in ["P0", "P1"]:
+                raise RTASException("HorizontalRegression: samples must be held by P0 or P1, but get %s" % party)
+        self.data_owners = data_owners
+        self.weights = self._zero_weights(n_features)
+
+    def _forward(self, x: RTASValue, party: str) -> RTASValue:
+        n = x.shape[0]
+        z = self.rtas.product(x, self.weights, np.matmul, triple_source=("horizontal-z", party, n))
+        return self._activate(z, ("horizontal-activation", party, n))
+
+    def train_batch(self, x_local: np.ndarray=None, y_local: np.ndarray=None):
+        """
+        :param x_local: The samples of the batch held by this party, each data owner has its own rows
+        :param y_local: The labels of x_local
+        :return:
+        """
+        grad = None
+        n_samples = 0
+        for party in self.data_owners:
+            x = self.rtas.new_private(lambda: x_local, party)
+            n = x.shape[0]
+            error = self.rtas.isub(self._forward(x, party),
+                                   self.rtas.share(self.rtas.new_private(lambda: y_local, party)))
+            grad_party = self.rtas.product(x, error, transpose_matmul, triple_source=("horizontal-grad", party, n))
+            grad = grad_party if grad is None else self.rtas.iadd(grad, grad_party)
+            n_samples += n
+        self._gradient_step(self.weights, grad, n_samples)
+        self.steps += 1
+        self.samples += n_samples
+
+    def predict(self, x_local: np.ndarray=None, party: str="P0") -> RTASValue:
+        """
+        :param x_local: Samples held by party
+        :param party:
+        :return: The shared prediction
+        """
+        return self._forward(self.rtas.new_private(lambda: x_local, party), party)
+
+    def reveal_weights(self, party: str="P0") -> np.ndarray:
+        return self.rtas.reveal_to(self.weights, party)
+
+
+class VerticalLinearRegression(VerticalRegression):
+    logistic = False
+
+
+class VerticalLogisticRegression(VerticalRegression):
+    logistic = True
+
+
+class HorizontalLinearRegression(HorizontalRegression):
+    logistic = False
+
+
+class HorizontalLogisticRegression(HorizontalRegression):
+    logistic = True
@@ -0,0 +1,2 @@
+from FastRTAS.ML.Regression import VerticalLinearRegression, VerticalLogisticRegression, \
+    HorizontalLinearRegression, HorizontalLogisticRegression
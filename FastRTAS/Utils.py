@@ -1,4 +1,9 @@
 import threading
+import numpy as np
+try:
+    from numpy.lib.array_utils import normalize_axis_tuple
+except ImportError:
+    from numpy.core.numeric import normalize_axis_tuple
 
 
 def parallel(funcs, params):
@@ -14,6 +19,7 @@ def parallel(funcs, params):
     if isinstance(funcs, list):
         for func, param in zip(funcs, params):
             threads.append(threading.Thread(target=func_wrapper, args=(func, param)))
+            threads[-1].start()
     else:
         for param in params:
             threads.append(threading.Thread(target=func_wrapper, args=(funcs, param)))
@@ -24,3 +30,39 @@ def parallel(funcs, params):
         return None
     else:
         return errors
+
+
+def matmul_shape(shape_x: tuple, shape_y: tuple) -> tuple:
+    """
+    Shape of np.matmul(x, y) computed from the operand shapes only
+    """
+    if len(shape_x) == 0 or len(shape_y) == 0:
+        return np.broadcast_shapes(shape_x, shape_y)
+    a = (1,) + shape_x if len(shape_x) == 1 else shape_x
+    b = shape_y + (1,) if len(shape_y) == 1 else shape_y
+    shape = np.broadcast_shapes(a[:-2], b[:-2]) + (a[-2], b[-1])
+    if len(shape_y) == 1:
+        shape = shape[:-1]
+    if len(shape_x) == 1:
+        shape = shape[:-2] + shape[-1:] if len(shape_y) > 1 else shape[:-1]
+    return shape
+
+
+def inner(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Dot products along the last axis, broadcasting the other axes
+    """
+    return np.einsum("...i,...i->...", x, y)
+
+
+def reduced_shape(shape: tuple, axis=None, keepdims: bool=False) -> tuple:
+    """
+    Shape of np.sum(x, axis, keepdims=keepdims) computed from the shape of x only,
+    raises a ValueError like np.sum if an axis is out of range or repeated
+    """
+    if axis is None:
+        axis = tuple(range(len(shape)))
+    axis = normalize_axis_tuple(axis, len(shape))
+    if keepdims:
+        return tuple(1 if i in axis else d for i, d in enumerate(shape))
+    return tuple(d for i, d in enumerate(shape) if i not in axis)
@@ -19,12 +19,60 @@ try:
     np_recvd = p1.recv("P0", "Test")
     p0.terminate()
     p1.terminate()
+    metrics = p0.metrics["P1"]
     if np.prod(np_recvd == np_sent) != 1:
         print("Send failed, expect %s but get %s" % (np_sent, np_recvd))
         unpassed += 1
+    elif not np_recvd.flags.writeable:
+        print("Received array should be writable")
+        unpassed += 1
+    elif metrics.sent_wire_bytes != metrics.sent_raw_bytes + 1:
+        # Uncompressed messages are the raw frame plus the codec id
+        print("Uncompressed metrics are wrong: %s" % metrics)
+        unpassed += 1
+    else:
+        passed += 1
+except Exception as e:
+    print("Error:", e)
+
+print("=====Test peer send compressed")
+try:
+    p0 = Peer("127.0.0.1:8482", {"127.0.0.1:8483": "P1"}, compression=["shuffle-zlib"], compress_threshold=1024)
+    p1 = Peer("127.0.0.1:8483", {"127.0.0.1:8482": "P0"}, compression=["zlib"], compress_threshold=1024)
+    p0.connect_all()
+    p1.connect_all()
+    time.sleep(0.1)
+    # Sparse fixed-point like values, should compress well
+    np_sent = np.zeros([1000])
+    np_sent[::10] = np.round(np.random.normal(0, 1, [100]), 2)
+    small_sent = np.array([1., 2., 3.])
+    send_thread = threading.Thread(target=p0.send, args=("P1", "Test", (np_sent, small_sent)))
+    send_thread.start()
+    np_recvd, small_recvd = p1.recv("P0", "Test")
+    send_thread.join()
+    send_thread = threading.Thread(target=p1.send, args=("P0", "Test", np_sent))
+    send_thread.start()
+    np_recvd_p0 = p0.recv("P1", "Test")
+    send_thread.join()
+    p0.terminate()
+    p1.terminate()
+    metrics_p0 = p0.metrics["P1"]
+    metrics_p1 = p1.metrics["P0"]
+    if not np.array_equal(np_recvd, np_sent) or not np.array_equal(small_recvd, small_sent) or \
+            not np.array_equal(np_recvd_p0, np_sent):
+        print("Send failed, expect %s but get %s" % (np_sent, np_recvd))
+        unpassed += 1
+    elif p0.peer_codecs["P1"] != "shuffle-zlib" or p1.peer_codecs["P0"] != "zlib":
+        print("Negotiated codecs are wrong: %s, %s" % (p0.peer_codecs, p1.peer_codecs))
+        unpassed += 1
+    elif metrics_p0.sent_compressed_messages != 1 or metrics_p0.compression_ratio() <= 1 or \
+            metrics_p1.compression_ratio() <= 1:
+        print("Message should be compressed, but metrics are %s, %s" % (metrics_p0, metrics_p1))
+        unpassed += 1
     else:
         passed += 1
 except Exception as e:
     print("Error:", e)
+    unpassed += 1
 
 print("=================\nAll tests done, passed: %d, unpassed %d" % (passed, unpassed))
\ No newline at end of file
@@ -0,0 +1,71 @@
+import numpy as np
+from FastRTAS.Core.Backends import NumpyBackend
+from FastRTAS.Utils import inner
+
+
+# Worker processes of the pool re-import the main module, so the tests only run in the main process
+if __name__ == "__main__":
+    passed = unpassed = 0
+
+    print("Test NumpyBackend:")
+
+    def check_triples(triples_0, triples_1, n, func):
+        if len(triples_0) != n or len(triples_1) != n:
+            return "Expect %d triples but get %d, %d" % (n, len(triples_0), len(triples_1))
+        for (u0, v0, w0), (u1, v1, w1) in zip(triples_0, triples_1):
+            if not np.allclose(w0 + w1, func(u0 + u1, v0 + v1)):
+                return "w0 + w1 != func(u0 + u1, v0 + v1)"
+        return None
+
+    backend = NumpyBackend(5, seed=0)
+
+    for name, shape_0, shape_1, func in [
+            ("multiply broadcast", [3, 4], [4], np.multiply),
+            ("matmul", [3, 4], [4, 2], np.matmul),
+            ("matmul vector", [4], [4, 2], np.matmul),
+            ("dot vector", [4], [4], np.dot),
+            ("inner", [3, 4], [4], inner),
+            ("lambda", [3, 4], [4, 3], lambda a, b: np.trace(a @ b))]:
+        print("=====Test batched triples " + name)
+        try:
+            triples_0, triples_1 = backend.get_product_triples(16, shape_0, shape_1, func)
+            error = check_triples(triples_0, triples_1, 16, func)
+            if error is None:
+                passed += 1
+            else:
+                print("Error:", error)
+                unpassed += 1
+        except Exception as e:
+            print("Error:", e)
+            unpassed += 1
+
+    print("=====Test batched private triples")
+    try:
+        owner_triples, other_triples = backend.get_private_product_triples(8, [3, 4], [4], np.matmul)
+        shared_first_triples, _ = backend.get_private_product_triples(8, [4], [3, 4], np.matmul, private_first=False)
+        if all(np.allclose(w0 + w1, u @ v) for (u, w0), (v, w1) in zip(owner_triples, other_triples)) and \
+                shared_first_triples[0][1].shape == (3,):
+            passed += 1
+        else:
+            print("Error: w0 + w1 != func(u, v)")
+            unpassed += 1
+    except Exception as e:
+        print("Error:", e)
+        unpassed += 1
+
+    print("=====Test triples in process pool")
+    try:
+        pool_backend = NumpyBackend(5, seed=0, processes=2, parallel_threshold=0)
+        triples_0, triples_1 = pool_backend.get_product_triples(5, [3, 4], [4, 2], np.matmul)
+        error = check_triples(triples_0, triples_1, 5, np.matmul)
+        pool_backend.close()
+        if error is None:
+            passed += 1
+        else:
+            print("Error:", error)
+            unpassed += 1
+    except Exception as e:
+        print("Error:", e)
+        unpassed += 1
+
+    print("=================\nAll tests done, passed: %d, unpassed %d" % (passed, unpassed))
@@ -0,0 +1,72 @@
+import operator
+import numpy as np
+from FastRTAS.Core.Backends import ThreadedBackend
+
+
+passed = unpassed = 0
+
+print("Test ThreadedBackend:")
+
+print("=====Test masks are deterministic")
+try:
+    # P0 and P1 may run different numbers of threads
+    backend_0 = ThreadedBackend(42, streams=4, threads=4, min_elements=64)
+    backend_1 = ThreadedBackend(42, streams=4, threads=1, min_elements=64)
+    masks_0 = [backend_0.normal(5, shape) for shape in [[3], [100, 7], [1000]]]
+    masks_1 = [backend_1.normal(5, shape) for shape in [[3], [100, 7], [1000]]]
+    if not all(np.array_equal(m0, m1) for m0, m1 in zip(masks_0, masks_1)):
+        print("Masks of the same seed and streams should be equal")
+        unpassed += 1
+    elif [m.shape for m in masks_0] != [(3,), (100, 7), (1000,)] or not 4.5 < np.std(masks_0[1]) < 5.5:
+        print("Masks should have the requested shapes and std 5")
+        unpassed += 1
+    else:
+        passed += 1
+    backend_0.close()
+    backend_1.close()
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+backend = ThreadedBackend(0, streams=4, min_elements=64)
+
+print("=====Test elementwise sum of products")
+try:
+    rng = np.random.default_rng(0)
+    a, b, c, d = rng.normal(0, 1, [50, 30]), rng.normal(0, 1, [30]), rng.normal(0, 1, [50, 30]), rng.normal(0, 1, [50, 1])
+    w = rng.normal(0, 1, [50, 30])
+    out = np.empty([50, 30])
+    results = [backend.sum_products(np.multiply, [(a, b), (c, d)], w),
+               backend.sum_products(operator.mul, [(a, b), (c, d)], w, out=out),
+               backend.sum_products(np.multiply, [(a[:2, :3], b[:3])], w[:2, :3])]
+    expected = [a * b + c * d + w] * 2 + [a[:2, :3] * b[:3] + w[:2, :3]]
+    if not all(np.allclose(r, e) for r, e in zip(results, expected)):
+        print("Sum of products is wrong")
+        unpassed += 1
+    elif results[1] is not out:
+        print("Result should be written into out")
+        unpassed += 1
+    else:
+        passed += 1
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test non-elementwise sum of products")
+try:
+    rng = np.random.default_rng(1)
+    a, b, c, d = rng.normal(0, 1, [4, 5]), rng.normal(0, 1, [5, 3]), rng.normal(0, 1, [4, 5]), rng.normal(0, 1, [5, 3])
+    w = rng.normal(0, 1, [4, 3])
+    result = backend.sum_products(np.matmul, [(a, b), (c, d)], w)
+    if np.allclose(result, a @ b + c @ d + w):
+        passed += 1
+    else:
+        print("Sum of matmul products is wrong")
+        unpassed += 1
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+backend.close()
+
+print("=================\nAll tests done, passed: %d, unpassed %d" % (passed, unpassed))
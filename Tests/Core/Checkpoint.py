@@ -0,0 +1,139 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from FastRTAS.Utils import parallel
+from FastRTAS.Core.RTAS import RTAS
+from FastRTAS.Core.Checkpoint import checkpoint, restore
+
+
+passed = unpassed = 0
+
+print("Test Checkpoint:")
+
+checkpoint_path = tempfile.mkdtemp()
+x_P0 = np.random.normal(0, 1, [3])
+y_P1 = np.random.normal(0, 1, [3])
+z_P2 = np.random.normal(0, 1, [3])
+
+
+def new_session(base_port: int):
+    parties = dict()
+    addr_dict = {"127.0.0.1:%d" % (base_port + i): "P%d" % i for i in range(3)}
+
+    def rtas_setup(party: str):
+        parties[party] = RTAS(addr_dict, party, {"rtas.cached_triples": 4, "rtas.threads": 2, "rtas.thread_min_elements": 2})
+        time.sleep(1)
+
+    errs = parallel(rtas_setup, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        raise errs[0]
+    return parties
+
+
+def continue_session(rtas: RTAS, values: dict):
+    """
+    The computation after the checkpoint. The product and w use the cached triples and the synced PRNG,
+    so their shares are replayed exactly, z is shared by P2, which gets fresh randomness after restore
+    :return: (shares of x * y + w, revealed x * y + w + z)
+    """
+    z = rtas.share(rtas.new_private(lambda: z_P2, "P2", shape=[3]))
+    w = rtas.share(rtas.new_private(lambda: x_P0, "P0", shape=[3]))
+    product = rtas.product(values["x"], values["y"], np.multiply, triple_source="xy")
+    rtas.iadd(product, w)
+    replayed_share = None if product.value is None else product.value.copy()
+    rtas.iadd(product, z)
+    return replayed_share, rtas.reveal_to(product, "P2")
+
+
+print("=====Test checkpoint")
+results_before = dict()
+try:
+    parties = new_session(4920)
+
+    def run_and_checkpoint(party_name: str):
+        rtas = parties[party_name]
+        rtas.set_up()
+        x = rtas.share(rtas.new_private(lambda: x_P0, "P0", shape=[3]))
+        y = rtas.share(rtas.new_private(lambda: y_P1, "P1", shape=[3]))
+        rtas.product(x, y, np.multiply, triple_source="xy")
+        checkpoint(rtas, checkpoint_path, 1, {"x": x, "y": y})
+        checkpoint(rtas, checkpoint_path, 2, {"x": x, "y": y}, keep=1)
+        results_before[party_name] = continue_session(rtas, {"x": x, "y": y})
+
+    errs = parallel(run_and_checkpoint, [("P0",), ("P1",), ("P2",)])
+    for party in parties.values():
+        party.peer.terminate()
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    elif os.listdir(checkpoint_path) != ["2"]:
+        print("Only the last checkpoint should be kept, but get %s" % os.listdir(checkpoint_path))
+        unpassed += 1
+    else:
+        passed += 1
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+
+# P0 crashed while writing checkpoint 3, so it is not complete
+os.makedirs(os.path.join(checkpoint_path, "3", "P0"))
+
+
+def restore_session(base_port: int, reuse_triples: bool):
+    parties = new_session(base_port)
+    results = dict()
+
+    def restore_and_run(party_name: str):
+        rtas = parties[party_name]
+        values = restore(rtas, checkpoint_path, reuse_triples=reuse_triples)
+        results[party_name] = continue_session(rtas, values) + (rtas.triple_stats["xy"].refills,)
+
+    errs = parallel(restore_and_run, [("P0",), ("P1",), ("P2",)])
+    for party in parties.values():
+        party.peer.terminate()
+    return errs, results
+
+
+print("=====Test restore")
+try:
+    errs, results_after = restore_session(4923, False)
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    elif not np.allclose(results_after["P2"][1], x_P0 * y_P1 + z_P2 + x_P0):
+        print("Restored session should get %s, but get %s" % (x_P0 * y_P1 + z_P2 + x_P0, results_after["P2"][1]))
+        unpassed += 1
+    elif any(results_after[p][2] != 2 for p in results_after) or \
+            any(np.array_equal(results_before[p][0], results_after[p][0]) for p in ["P0", "P1"]):
+        print("Restored session should drop the cached triples and use new ones")
+        unpassed += 1
+    else:
+        passed += 1
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+
+print("=====Test restore reusing triples")
+try:
+    errs, results_after = restore_session(4926, True)
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    elif not np.allclose(results_after["P2"][1], x_P0 * y_P1 + z_P2 + x_P0):
+        print("Restored session should get %s, but get %s" % (x_P0 * y_P1 + z_P2 + x_P0, results_after["P2"][1]))
+        unpassed += 1
+    elif any(results_after[p][2] != 1 for p in results_after) or \
+            not all(np.array_equal(results_before[p][0], results_after[p][0]) for p in ["P0", "P1"]):
+        print("Restored session should replay the shares of the product and w with the cached triples")
+        unpassed += 1
+    else:
+        passed += 1
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=================\nAll tests done, passed: %d, unpassed %d" % (passed, unpassed))
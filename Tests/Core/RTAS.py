@@ -1,8 +1,11 @@
 import time
 
+import operator
 import numpy as np
+import scipy.sparse as sp
 from FastRTAS.Utils import parallel
-from FastRTAS.Core.RTAS import RTAS
+from FastRTAS.Core.RTAS import RTAS, RTASValue, RTASMode, RTASException
+from FastRTAS.Core.Backends import ThreadedBackend
 
 
 passed = unpassed = 0
@@ -209,6 +212,364 @@ except Exception as e:
     print("Error:", e)
     unpassed += 1
 
+print("=====Test product shared shared")
+try:
+    product_of_shared = dict()
+    revealed_product = dict()
+
+    def shared_product(party_name: str):
+        rtas = parties[party_name]
+        product_of_shared[party_name] = rtas.product(shared_vals_P0[party_name], shared_vals_P2[party_name],
+                                                     np.multiply, [3], [3], "shared_product")
+        revealed_product[party_name] = rtas.reveal_to(product_of_shared[party_name], "P2")
+
+    errs = parallel(shared_product, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        if np.allclose(revealed_product["P2"], to_be_shared_P0 * to_be_shared_P2):
+            passed += 1
+        else:
+            print("Product of shared values should be %s but is %s" %
+                  (to_be_shared_P0 * to_be_shared_P2, revealed_product["P2"]))
+            unpassed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+
+print("=====Test product sparse private(P1) shared")
+try:
+    sparse_P1 = sp.random(4, 3, density=0.3, format="csr")
+    revealed_sparse_product = dict()
+
+    def sparse_product(party_name: str):
+        rtas = parties[party_name]
+        private_val = rtas.new_private(lambda: sparse_P1, "P1", shape=[4, 3])
+        product_val = rtas.product(private_val, shared_vals_P0[party_name], operator.matmul, shape_y=[3])
+        revealed_sparse_product[party_name] = rtas.reveal_to(product_val, "P2")
+
+    errs = parallel(sparse_product, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        if np.allclose(revealed_sparse_product["P2"], sparse_P1 @ to_be_shared_P0):
+            passed += 1
+        else:
+            print("Product of sparse private and shared values should be %s but is %s" %
+                  (sparse_P1 @ to_be_shared_P0, revealed_sparse_product["P2"]))
+            unpassed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test product out and in-place updates")
+try:
+    revealed_inplace = dict()
+    returned_out = dict()
+
+    def inplace_ops(party_name: str):
+        rtas = parties[party_name]
+        out = RTASValue(RTASMode.Shared, np.empty([3]) if party_name in ["P0", "P1"] else None, ["P0", "P1"])
+        product_val = rtas.product(shared_vals_P0[party_name], shared_vals_P2[party_name],
+                                   np.multiply, [3], [3], "shared_product", out=out)
+        returned_out[party_name] = product_val is out
+        rtas.iadd(out, public_vals_P2[party_name])
+        rtas.imul_public(out, public_vals_P2[party_name])
+        rtas.isub(out, shared_vals_P0[party_name])
+        revealed_inplace[party_name] = rtas.reveal_to(out, "P2")
+
+    errs = parallel(inplace_ops, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        expected = (to_be_shared_P0 * to_be_shared_P2 + pub_val_P2) * pub_val_P2 - to_be_shared_P0
+        if not all(returned_out.values()):
+            print("product should return the out value")
+            unpassed += 1
+        elif parties["P0"].scratch.hits == 0:
+            print("Scratch buffers should be reused by consecutive products")
+            unpassed += 1
+        elif np.allclose(revealed_inplace["P2"], expected):
+            passed += 1
+        else:
+            print("In-place result should be %s but is %s" % (expected, revealed_inplace["P2"]))
+            unpassed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test shape and dtype on all parties")
+try:
+    meta_vals = dict()
+
+    def rtas_meta(party_name: str):
+        rtas = parties[party_name]
+        # No shape is given, P2 plans the triples with the shapes carried by the shared values
+        product_val = rtas.product(shared_vals_P0[party_name], shared_vals_P2[party_name], np.multiply,
+                                   triple_source="no_shape_product")
+        matmul_val = rtas.linear(private_vals_P0[party_name], public_vals_P2[party_name], operator.matmul)
+        # Dividing integers gives floats on the holder, the others must agree without evaluating it
+        int_val = rtas.new_private(lambda: np.arange(1, 4), "P0", shape=[3], dtype=np.int64)
+        divide_val = rtas.product(int_val, int_val, np.true_divide)
+        meta_vals[party_name] = (private_vals_P0[party_name], product_val, matmul_val, divide_val)
+
+    errs = parallel(rtas_meta, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        metas = [(v.shape, v.dtype, v.owner) for party_name in meta_vals for v in meta_vals[party_name]]
+        expected = [((3,), np.dtype(np.float64), ("P0",)), ((3,), np.dtype(np.float64), ("P0", "P1")),
+                    ((), np.dtype(np.float64), ("P0",)), ((3,), np.dtype(np.float64), ("P0",))] * 3
+        if metas != expected:
+            print("Metadata should be %s but is %s" % (expected, metas))
+            unpassed += 1
+        elif hasattr(meta_vals["P2"][0], "__dict__"):
+            print("RTASValue should be slotted")
+            unpassed += 1
+        else:
+            passed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test dot, matvec, sum and mean")
+try:
+    matrix_P1 = np.random.normal(0, 1, [2, 3])
+    reduced_vals = dict()
+
+    def rtas_reduce(party_name: str):
+        rtas = parties[party_name]
+        shared_matrix = rtas.share(rtas.new_private(lambda: matrix_P1, "P1"))
+        dot_val = rtas.dot(shared_vals_P0[party_name], shared_vals_P2[party_name])
+        matvec_val = rtas.matvec(shared_matrix, shared_vals_P0[party_name])
+        sum_val = rtas.sum(shared_matrix, axis=0)
+        mean_val = rtas.mean(shared_matrix)
+        reduced_vals[party_name] = [rtas.reveal_to(v, "P2") for v in [dot_val, matvec_val, sum_val, mean_val]]
+        reduced_vals[party_name].append(dot_val.shape)
+
+    errs = parallel(rtas_reduce, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        expected = [to_be_shared_P0 @ to_be_shared_P2, matrix_P1 @ to_be_shared_P0,
+                    matrix_P1.sum(axis=0), matrix_P1.mean()]
+        # The correlation w of the dot product triple is a scalar
+        dot_triple_w = parties["P0"].triple_sources[("dot", (3,), (3,))][-1][2]
+        if not all(np.allclose(a, b) for a, b in zip(reduced_vals["P2"], expected)):
+            print("Reduced values should be %s but are %s" % (expected, reduced_vals["P2"]))
+            unpassed += 1
+        elif reduced_vals["P2"][-1] != () or np.shape(dot_triple_w) != ():
+            print("Dot product and its triple should be scalars")
+            unpassed += 1
+        else:
+            passed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test invalid reductions raise on all parties")
+try:
+    invalid_errors = dict()
+
+    def rtas_invalid_reduce(party_name: str):
+        rtas = parties[party_name]
+        vector = shared_vals_P0[party_name]
+        scalar = meta_vals[party_name][2]
+        no_shape = RTASValue(vector.mode, None, vector.owner_mask)
+        invalid_errors[party_name] = []
+        for reduce in [lambda: rtas.sum(vector, axis=1), lambda: rtas.mean(vector, axis=(0, -1)),
+                       lambda: rtas.sum(scalar, axis=0), lambda: rtas.dot(no_shape, vector),
+                       lambda: rtas.matvec(vector, no_shape)]:
+            try:
+                reduce()
+                invalid_errors[party_name].append(None)
+            except RTASException:
+                invalid_errors[party_name].append(RTASException)
+
+    errs = parallel(rtas_invalid_reduce, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    elif any(errors != [RTASException] * 5 for errors in invalid_errors.values()):
+        print("Invalid reductions should raise RTASException, but get %s" % invalid_errors)
+        unpassed += 1
+    else:
+        passed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test adaptive triple batches")
+try:
+    batch_sizes = dict()
+
+    def adaptive_products(party_name: str):
+        rtas = parties[party_name]
+        old_configs = rtas.cached_triples, rtas.triple_memory_budget, rtas.triple_refill_interval
+        # A triple of multiplying two float64 vectors of length 3 takes 72 bytes, so at most 5 triples are cached.
+        # Triples are consumed much faster than one refill per 100 seconds, so the batch grows until the budget.
+        # The rate reported at a refill sizes the next refill, so the first two batches have the initial size
+        rtas.cached_triples = 2
+        rtas.triple_memory_budget = 5 * 72
+        rtas.triple_refill_interval = 100
+        batch_sizes[party_name] = []
+        try:
+            for _ in range(20):
+                rtas.product(shared_vals_P0[party_name], shared_vals_P2[party_name], np.multiply, [3], [3],
+                             "adaptive")
+                batch_sizes[party_name].append(rtas.triple_stats["adaptive"].batch_size)
+        finally:
+            rtas.cached_triples, rtas.triple_memory_budget, rtas.triple_refill_interval = old_configs
+
+    errs = parallel(adaptive_products, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        stats = {party_name: parties[party_name].triple_stats["adaptive"] for party_name in parties}
+        if batch_sizes["P2"][:5] != [2, 2, 2, 2, 4] or max(batch_sizes["P2"]) != 5:
+            print("Batch sizes should grow from 2 to 5, but are %s" % batch_sizes["P2"])
+            unpassed += 1
+        elif not (batch_sizes["P0"] == batch_sizes["P1"] == batch_sizes["P2"]):
+            print("All parties should see the same batch sizes, but see %s" % batch_sizes)
+            unpassed += 1
+        elif any(s.consumed != 20 or s.cached != len(parties["P0"].triple_sources["adaptive"]) or
+                 s.triple_bytes != 72 for s in stats.values()):
+            print("Triple stats are wrong: %s" % stats)
+            unpassed += 1
+        else:
+            passed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test triple batches shrink when consumption is slow")
+try:
+    batch_sizes = dict()
+
+    def slow_products(party_name: str):
+        rtas = parties[party_name]
+        old_configs = rtas.cached_triples, rtas.triple_refill_interval
+        # About 50 triples are consumed per second, so a refill every 0.05 seconds needs less than 3 triples.
+        # The rate of the first batch sizes the third batch
+        rtas.cached_triples = 8
+        rtas.triple_refill_interval = 0.05
+        batch_sizes[party_name] = []
+        try:
+            for _ in range(24):
+                time.sleep(0.02)
+                rtas.product(shared_vals_P0[party_name], shared_vals_P2[party_name], np.multiply, [3], [3],
+                             "slow")
+                batch_sizes[party_name].append(rtas.triple_stats["slow"].batch_size)
+        finally:
+            rtas.cached_triples, rtas.triple_refill_interval = old_configs
+
+    errs = parallel(slow_products, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        rate = parties["P2"].triple_stats["slow"].rate
+        if batch_sizes["P2"][:16] != [8] * 16 or max(batch_sizes["P2"][16:]) > 4:
+            print("Batch sizes should shrink from 8, but are %s" % batch_sizes["P2"])
+            unpassed += 1
+        elif rate is None or rate > 60:
+            print("The consumption rate should be about 50/s, but is %s" % rate)
+            unpassed += 1
+        else:
+            passed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test fixed triple batches within the memory budget")
+try:
+    batch_sizes = dict()
+
+    def fixed_products(party_name: str):
+        rtas = parties[party_name]
+        old_configs = rtas.cached_triples, rtas.triple_memory_budget, rtas.adaptive_triples
+        # At most 5 triples of 72 bytes fit in the budget, so every batch has 5 triples
+        rtas.cached_triples = 8
+        rtas.triple_memory_budget = 5 * 72
+        rtas.adaptive_triples = False
+        batch_sizes[party_name] = []
+        try:
+            for _ in range(12):
+                rtas.product(shared_vals_P0[party_name], shared_vals_P2[party_name], np.multiply, [3], [3],
+                             "fixed")
+                batch_sizes[party_name].append(rtas.triple_stats["fixed"].batch_size)
+        finally:
+            rtas.cached_triples, rtas.triple_memory_budget, rtas.adaptive_triples = old_configs
+
+    errs = parallel(fixed_products, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    elif batch_sizes["P2"] != [5] * 12 or parties["P2"].triple_stats["fixed"].refills != 3:
+        print("Every batch should have 5 triples, but batch sizes are %s" % batch_sizes["P2"])
+        unpassed += 1
+    else:
+        passed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+print("=====Test share and product on threads")
+try:
+    big_P0 = np.random.normal(0, 1, [40, 8])
+    big_P1 = np.random.normal(0, 1, [40, 8])
+    matrix_P1 = np.random.normal(0, 1, [8, 5])
+    threaded_vals = dict()
+
+    def threaded_product(party_name: str):
+        rtas = parties[party_name]
+        if party_name in ["P0", "P1"]:
+            # Same as set_up with rtas.threads=4 and rtas.thread_min_elements=16
+            rtas.cpu_backend = ThreadedBackend(7, 4, 4 if party_name == "P0" else 2, 16)
+        x = rtas.share(rtas.new_private(lambda: big_P0, "P0", shape=[40, 8]))
+        y = rtas.share(rtas.new_private(lambda: big_P1, "P1", shape=[40, 8]))
+        m = rtas.share(rtas.new_private(lambda: matrix_P1, "P1", shape=[8, 5]))
+        products = [rtas.product(x, y, np.multiply, triple_source="threaded multiply"),
+                    rtas.product(x, m, np.matmul, triple_source="threaded matmul"),
+                    rtas.product(rtas.new_private(lambda: big_P1, "P1", shape=[40, 8]), x, np.multiply,
+                                 triple_source="threaded private")]
+        threaded_vals[party_name] = [rtas.reveal_to(v, "P2") for v in products]
+        if rtas.cpu_backend is not None:
+            rtas.cpu_backend.close()
+            rtas.cpu_backend = None
+
+    errs = parallel(threaded_product, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        expected = [big_P0 * big_P1, big_P0 @ matrix_P1, big_P1 * big_P0]
+        if all(np.allclose(a, b) for a, b in zip(threaded_vals["P2"], expected)):
+            passed += 1
+        else:
+            print("Products on threads should be %s but are %s" % (expected, threaded_vals["P2"]))
+            unpassed += 1
+
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
 for party in parties.values():
     party.peer.terminate()
 
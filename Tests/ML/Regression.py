@@ -0,0 +1,103 @@
+import time
+
+import numpy as np
+from FastRTAS.Utils import parallel
+from FastRTAS.Core.RTAS import RTAS
+from FastRTAS.ML import VerticalLinearRegression, HorizontalLogisticRegression
+
+
+passed = unpassed = 0
+
+print("Test Regression:")
+
+print("=====Test setup")
+parties = dict()
+try:
+    def rtas_setup(party: str):
+        rtas = RTAS({"127.0.0.1:4910": "P0", "127.0.0.1:4911": "P1", "127.0.0.1:4912": "P2"}, party,
+                    {"rtas.cached_triples": 16})
+        time.sleep(1)
+        rtas.set_up()
+        parties[party] = rtas
+
+    errs = parallel(rtas_setup, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        passed += 1
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+
+print("=====Test vertical linear regression")
+try:
+    rng = np.random.default_rng(0)
+    xs = rng.normal(0, 1, [256, 3])
+    true_w = np.array([1.0, -2.0, 0.5])
+    ys = xs @ true_w
+    # P0 holds the first 2 columns, P1 holds the last column and the labels
+    local_xs = {"P0": xs[:, :2], "P1": xs[:, 2:], "P2": None}
+    revealed_weights = dict()
+
+    def vertical_train(party_name: str):
+        model = VerticalLinearRegression(parties[party_name], {"P0": 2, "P1": 1}, "P1", learning_rate=0.3)
+        for epoch in range(5):
+            for i in range(0, 256, 32):
+                x_local = None if local_xs[party_name] is None else local_xs[party_name][i: i + 32]
+                model.train_batch(x_local, ys[i: i + 32] if party_name == "P1" else None)
+        revealed_weights[party_name] = model.reveal_weights("P2")
+
+    errs = parallel(vertical_train, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        w = np.concatenate([revealed_weights["P2"]["P0"], revealed_weights["P2"]["P1"]])
+        if np.allclose(w, true_w, atol=0.05):
+            passed += 1
+        else:
+            print("Weights should be close to %s, but are %s" % (true_w, w))
+            unpassed += 1
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+
+print("=====Test horizontal logistic regression")
+try:
+    rng = np.random.default_rng(1)
+    xs = rng.normal(0, 1, [512, 4])
+    ys = (xs @ np.array([2.0, -1.0, 1.0, 0.0]) > 0).astype(np.float64)
+    # P0 holds the first half of the samples and P1 holds the second half
+    local_data = {"P0": (xs[:256], ys[:256]), "P1": (xs[256:], ys[256:]), "P2": (None, None)}
+    revealed_weights = dict()
+
+    def horizontal_train(party_name: str):
+        model = HorizontalLogisticRegression(parties[party_name], 4, learning_rate=1.0)
+        x_local, y_local = local_data[party_name]
+        for epoch in range(5):
+            model.fit((None, None) if x_local is None else (x_local[i: i + 64], y_local[i: i + 64])
+                      for i in range(0, 256, 64))
+        revealed_weights[party_name] = model.reveal_weights("P2")
+
+    errs = parallel(horizontal_train, [("P0",), ("P1",), ("P2",)])
+    if errs is not None:
+        print("Errors:", errs)
+        unpassed += 1
+    else:
+        accuracy = np.mean((xs @ revealed_weights["P2"] > 0) == ys)
+        if accuracy > 0.9:
+            passed += 1
+        else:
+            print("Accuracy should be > 0.9, but is %f" % accuracy)
+            unpassed += 1
+except Exception as e:
+    print("Error:", e)
+    unpassed += 1
+
+for party in parties.values():
+    party.peer.terminate()
+
+print("=================\nAll tests done, passed: %d, unpassed %d" % (passed, unpassed))